@@ -0,0 +1,198 @@
+"""Batch application of settings.
+
+A batch file describes, in TOML, the settings of any number of devices:
+
+    [[device]]
+    product = 0x170e            # select devices like in the CLI, by device
+                                # (listing number), vendor, product, usb-port
+                                # and/or serial
+    [device.speed]
+    pump = 90
+    fan = [[20, 30], [30, 50], [40, 90], [50, 100]]
+    [device.color.ring]
+    mode = "fading"
+    colors = ["350017", "ff2608"]
+    speed = "normal"            # animation speed; optional
+
+    [[device]]
+    product = 0x1714
+    initialize = true
+    [device.speed]
+    fan1 = 50
+
+All operations are parsed and validated before any device is touched.  They
+are then grouped per device, and each device is configured in a single
+connection; on each device, initialization comes first, then speeds and
+colors.
+
+    >>> from liquidctl.driver.kraken_two import KrakenTwoDriver
+    >>> from liquidctl.driver.simulated import *
+    >>> backend = SimulatedBackend([SimulatedKrakenTwo()])
+    >>> devices = list(enumerate(KrakenTwoDriver.find_supported_devices(backend=backend)))
+    >>> config = {'device': [{'speed': {'pump': 90}, 'color': {'logo': {'mode': 'fixed', 'colors': ['af5a2f']}}}]}
+    >>> [(num, ops) for num, dev, ops in plan(config, devices)]
+    [(0, [('set_fixed_speed', ('pump', 90)), ('set_color', ('logo', 'fixed', [[175, 90, 47]], 'normal'))])]
+    >>> plan({'device': [{'speed': {'fan1': 50}}]}, devices)
+    Traceback (most recent call last):
+        ...
+    ValueError: device entry 1: unknown speed channel fan1 for NZXT Kraken X (X42, X52, X62 or X72)
+    >>> plan({'device': [{'speed': {'fan': [[20, 30, 40]]}}]}, devices)
+    Traceback (most recent call last):
+        ...
+    ValueError: device entry 1: speed.fan profile must be [temperature, duty] pairs
+
+Reading TOML files requires Python 3.11 or the `toml` package.
+
+Copyright (C) 2018  Jonas Malaco
+Copyright (C) 2018  each contribution's author
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import logging
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+    try:
+        import toml
+    except ImportError:
+        toml = None
+
+
+LOGGER = logging.getLogger(__name__)
+
+SELECTION_KEYS = ['device', 'vendor', 'product', 'usb-port', 'serial']
+_OPERATION_KEYS = ['initialize', 'speed', 'color']
+_DEFAULT_ANIMATION_SPEED = 'normal'
+
+
+def load(file):
+    """Load a batch from a TOML text file object.
+
+    Raises `ImportError` if no TOML parser is available.
+    """
+    text = file.read()
+    if tomllib:
+        return tomllib.loads(text)
+    if toml:
+        return toml.loads(text)
+    raise ImportError('reading batch files requires Python 3.11 or the toml package')
+
+
+def plan(config, devices):
+    """Validate a batch against (listing number, driver) pairs.
+
+    Returns a list of (listing number, driver, operations) tuples, in device
+    order, where each operation is a (method name, arguments) tuple.  Raises
+    `ValueError` if any operation is invalid.
+    """
+    entries = config.get('device', [])
+    if not isinstance(entries, list) or set(config) - {'device'}:
+        raise ValueError('expected only [[device]] entries')
+    ops = {}
+    for i, entry in enumerate(entries, 1):
+        try:
+            unknown = set(entry) - set(SELECTION_KEYS + _OPERATION_KEYS)
+            if unknown:
+                raise ValueError('unknown keys: {}'.format(', '.join(sorted(unknown))))
+            selected = [(num, dev) for num, dev in devices if matches(num, dev, entry)]
+            if not selected:
+                raise ValueError('no devices match the selection')
+            for num, dev in selected:
+                init, speed, color = ops.setdefault(num, ([], [], []))
+                if entry.get('initialize'):
+                    init[:] = [('initialize', ())]
+                speed.extend(_speed_ops(dev, entry.get('speed', {})))
+                color.extend(_color_ops(dev, entry.get('color', {})))
+        except (TypeError, ValueError) as err:
+            raise ValueError('device entry {}: {}'.format(i, err)) from None
+    return [(num, dev, sum(ops[num], [])) for num, dev in devices if num in ops]
+
+
+def apply(dev, ops):
+    """Run the operations planned for `dev` in a single connection."""
+    dev.connect(session=True)
+    try:
+        for method, args in ops:
+            LOGGER.debug('%s: %s%r', dev.description, method, args)
+            getattr(dev, method)(*args)
+    finally:
+        dev.disconnect()
+
+
+def matches(num, dev, entry):
+    """Check whether device `num` matches the selection keys of `entry`."""
+    und = dev.device
+    return all([
+        'device' not in entry or num == _int(entry['device']),
+        'vendor' not in entry or und.idVendor == _int(entry['vendor']),
+        'product' not in entry or und.idProduct == _int(entry['product']),
+        'usb-port' not in entry or und.port_number == _int(entry['usb-port']),
+        'serial' not in entry or und.serial_number == entry['serial'],
+    ])
+
+
+def _speed_ops(dev, speeds):
+    if not isinstance(speeds, dict):
+        raise ValueError('speed must be a table of channels')
+    channels = dev.get_speed_channels()
+    for channel, value in speeds.items():
+        if channel not in channels:
+            raise ValueError('unknown speed channel {} for {}'.format(channel, dev.description))
+        if isinstance(value, list):
+            # profiles are rejected here, not half way through applying the batch
+            if not (hasattr(dev, 'set_speed_profile')
+                    and getattr(dev, 'supports_cooling_profiles', False)):
+                raise ValueError('speed profiles not supported by {}'.format(dev.description))
+            if not all(isinstance(point, list) and len(point) == 2 for point in value):
+                raise ValueError('speed.{} profile must be [temperature, duty] pairs'
+                                 .format(channel))
+            profile = [(int(temp), int(duty)) for temp, duty in value]
+            yield ('set_speed_profile', (channel, profile))
+        else:
+            yield ('set_fixed_speed', (channel, int(value)))
+
+
+def _color_ops(dev, colors):
+    if not isinstance(colors, dict):
+        raise ValueError('color must be a table of channels')
+    channels = dev.get_color_channels()
+    modes = dev.get_color_modes()
+    speeds = dev.get_animation_speeds()
+    for channel, setting in colors.items():
+        if channel not in channels:
+            raise ValueError('unknown color channel {} for {}'.format(channel, dev.description))
+        if not isinstance(setting, dict):
+            raise ValueError('color.{} must be a table'.format(channel))
+        unknown = set(setting) - {'mode', 'colors', 'speed'}
+        if unknown:
+            raise ValueError('unknown keys in color.{}: {}'.format(channel, ', '.join(sorted(unknown))))
+        mode = setting.get('mode')
+        if mode not in modes:
+            raise ValueError('unknown color mode {} for {}'.format(mode, dev.description))
+        values = [list(bytes.fromhex(color)) for color in setting.get('colors', [])]
+        mincolors = modes[mode][3]
+        if len(values) < mincolors:
+            raise ValueError('not enough colors for mode={}, at least {} required'
+                             .format(mode, mincolors))
+        speed = setting.get('speed', _DEFAULT_ANIMATION_SPEED)
+        if speed not in speeds:
+            raise ValueError('unknown animation speed {}'.format(speed))
+        yield ('set_color', (channel, mode, values, speed))
+
+
+def _int(value):
+    return int(value, 0) if isinstance(value, str) else int(value)
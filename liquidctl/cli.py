@@ -2,11 +2,15 @@
 
 Usage:
   liquidctl [options] status
+  liquidctl [options] monitor
   liquidctl [options] set <channel> speed (<temperature> <percentage>) ...
   liquidctl [options] set <channel> speed <percentage>
   liquidctl [options] set <channel> color <mode> [<color>] ...
   liquidctl [options] initialize
+  liquidctl [options] apply <file>
+  liquidctl [options] control <file>
   liquidctl [options] list
+  liquidctl [options] daemon
   liquidctl --help
   liquidctl --version
 
@@ -16,9 +20,21 @@ Device selection options:
   --product <id>            Filter devices by product id
   --usb-port <no>           Filter devices by USB port
   --serial <no>             Filter devices by serial number
+  -a, --all                 Apply set or initialize to all selected devices
+
+Monitoring options:
+  --interval <seconds>      Sampling interval [default: 1]
+  --format <fmt>            Output format: jsonl or csv [default: jsonl]
+  -o, --output <file>       Append the records to a file instead of stdout
+  --samples <n>             Stop after a number of samples
+
+Daemon options:
+  --socket <path>           Path of the daemon socket
+  --no-daemon               Access the devices directly, even if the daemon is running
 
 Other options:
   --speed <value>           Animation speed [default: normal]
+  -j, --jobs <n>            Maximum number of devices handled concurrently [default: 4]
   -n, --dry-run             Do not apply any settings
   -v, --verbose             Output additional information
   -g, --debug               Show debug information on stderr
@@ -27,10 +43,15 @@ Other options:
 
 Examples:
   liquidctl status
+  liquidctl monitor --interval 2 --format csv --output status.csv
   liquidctl set pump speed 90
   liquidctl set fan speed  20 30  30 50  34 80  40 90  50 100
   liquidctl set ring color fading 350017 ff2608
   liquidctl set logo color fixed af5a2f
+  liquidctl --all --vendor 0x1e71 initialize
+  liquidctl apply boot.toml
+  liquidctl control cooling.toml
+  liquidctl daemon &
 
 This program is free software: you can redistribute it and/or modify
 it under the terms of the GNU General Public License as published by
@@ -49,31 +70,36 @@ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 GNU General Public License for more details.
 """
 
-import inspect
-import itertools
 import logging
 import sys
 
 from docopt import docopt
 
-import liquidctl.util
-from liquidctl.driver.kraken_two import KrakenTwoDriver
-from liquidctl.driver.nzxt_smart_device import NzxtSmartDeviceDriver
+from liquidctl.driver.registry import DeviceRegistry
 from liquidctl.version import __version__
 
+# commands import what they need, and drivers (and pyusb) are only loaded by
+# the registry once devices are needed, so that --help or --version, and
+# commands served by the daemon, start quickly
 
 DRIVERS = [
-    KrakenTwoDriver,
-    NzxtSmartDeviceDriver,
+    'liquidctl.driver.kraken_two:KrakenTwoDriver',
+    'liquidctl.driver.nzxt_smart_device:NzxtSmartDeviceDriver',
 ]
 
+REGISTRY = DeviceRegistry(DRIVERS)
+
 
 LOGGER = logging.getLogger(__name__)
 
 
-def find_all_supported_devices():
-    res = map(lambda driver: driver.find_supported_devices(), DRIVERS)
-    return itertools.chain(*res)
+def find_all_supported_devices(use_daemon=False, socket_path=None):
+    """Find all supported devices, through the daemon if requested and running."""
+    registry = None
+    if use_daemon:
+        from liquidctl.daemon import find_daemon
+        registry = find_daemon(socket_path)
+    return iter((registry or REGISTRY).devices())
 
 
 def _filter_devices(devices, args):
@@ -94,6 +120,7 @@ def _filter_devices(devices, args):
 
 
 def _list_devices(devices, args):
+    import inspect
     for i, dev in devices:
         und = dev.device
         print('Device {}, {}'.format(i, dev.description))
@@ -110,18 +137,147 @@ def _list_devices(devices, args):
             print('')
 
 
-def _device_get_status(dev, num):
-    print('Device {}, {}'.format(num, dev.description))
+def _run_on_devices(devices, func, args):
+    """Run func(dev, args) on devices concurrently.
+
+    Yields (num, dev, result, error) in device order, as soon as available.
+    """
+    import concurrent.futures
+    jobs = max(1, min(int(args['--jobs']), len(devices)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [(num, dev, pool.submit(func, dev, args)) for num, dev in devices]
+        for num, dev, future in futures:
+            try:
+                yield num, dev, future.result(), None
+            except Exception as err:
+                LOGGER.debug('device %i failed', num, exc_info=True)
+                yield num, dev, None, err
+
+
+def _device_get_status(dev, args):
     dev.connect()
     try:
-        status = dev.get_status()
-        for k, v, u in status:
-            print('{:<18}    {:>10}  {:<3}'.format(k, v, u))
+        return dev.get_status()
     finally:
         dev.disconnect()
+
+
+def _print_status(dev, num, status):
+    print('Device {}, {}'.format(num, dev.description))
+    for k, v, u in status:
+        print('{:<18}    {:>10}  {:<3}'.format(k, v, u))
     print('')
 
 
+def _monitor(devices, args):
+    from liquidctl.monitor import StatusStream
+    from liquidctl.schedule import Ticker
+    interval = float(args['--interval'])
+    samples = int(args['--samples']) if args['--samples'] else None
+    out = open(args['--output'], 'a', newline='') if args['--output'] else sys.stdout
+    # do not repeat the CSV header when appending to an existing file
+    stream = StatusStream(out, fmt=args['--format'], header=out is sys.stdout or out.tell() == 0)
+    ticker = Ticker(interval)
+    connected = []
+    try:
+        # keep the devices claimed, and their reports drained, between samples
+        for num, dev in devices:
+            dev.connect(session=True)
+            connected.append((num, dev))
+            dev.start_background_reader()
+        for i, tick in enumerate(ticker):
+            for num, dev in connected:
+                try:
+                    record = dev.get_status_record(deadline=tick + interval)
+                except Exception as err:
+                    LOGGER.warning('Device %i, %s: %s', num, dev.description, err)
+                    continue
+                stream.write(num, dev.description, record)
+            if stream.failed or (samples and i + 1 >= samples):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for num, dev in connected:
+            dev.disconnect()
+        stream.close()
+        if out is not sys.stdout:
+            out.close()
+    if ticker.missed:
+        LOGGER.info('%i samples missed', ticker.missed)
+    if stream.failed and not isinstance(stream.failed, BrokenPipeError):
+        raise SystemExit('Failed to write the records: {}'.format(stream.failed))
+
+
+def _apply_batch(devices, args):
+    import liquidctl.batch
+    try:
+        if args['<file>'] == '-':
+            config = liquidctl.batch.load(sys.stdin)
+        else:
+            with open(args['<file>']) as f:
+                config = liquidctl.batch.load(f)
+        planned = liquidctl.batch.plan(config, devices)
+    except ImportError as err:
+        raise SystemExit(str(err))
+    except (OSError, ValueError) as err:
+        raise SystemExit('Invalid batch {}: {}'.format(args['<file>'], err))
+    plans = {dev: ops for _, dev, ops in planned}
+    failed = False
+    for num, dev, _, err in _run_on_devices([(num, dev) for num, dev, _ in planned],
+                                            lambda dev, args: liquidctl.batch.apply(dev, plans[dev]),
+                                            args):
+        if err:
+            LOGGER.error('Device %i, %s: %s', num, dev.description, err)
+            failed = True
+        else:
+            LOGGER.info('Device %i, %s: %i operations applied', num, dev.description, len(plans[dev]))
+    if failed:
+        sys.exit(1)
+
+
+def _control(devices, args):
+    import liquidctl.batch
+    import liquidctl.service
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    try:
+        with open(args['<file>']) as f:
+            config = liquidctl.batch.load(f)
+        service = liquidctl.service.plan(config, devices, psutil=psutil)
+    except ImportError as err:
+        raise SystemExit(str(err))
+    except (OSError, ValueError) as err:
+        raise SystemExit('Invalid control file {}: {}'.format(args['<file>'], err))
+    import signal
+    signal.signal(signal.SIGTERM, lambda signum, frame: service.stop())
+    try:
+        service.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for description, channel, sent, suppressed, failures in service.stats():
+            LOGGER.info('%s, %s: %i writes sent, %i suppressed, %i failed ticks', description,
+                        channel, sent, suppressed, failures)
+
+
+def _device_apply(dev, args):
+    dev.connect()
+    try:
+        if args['initialize']:
+            dev.initialize()
+        elif args['set'] and args['speed']:
+            _device_set_speed(dev, args)
+        elif args['set'] and args['color']:
+            _device_set_color(dev, args)
+        else:
+            raise Exception('Not sure what to do')
+    finally:
+        dev.disconnect()
+
+
 def _device_set_color(dev, args):
     color = map(lambda c: list(_parse_color(c)), args['<color>'])
     dev.set_color(args['<channel>'], args['<mode>'], color, args['--speed'])
@@ -157,7 +313,19 @@ def main():
     if args['--dry-run']:
         LOGGER.warning('This is a --dry-run')
 
-    all_devices = list(enumerate(find_all_supported_devices()))
+    if args['daemon']:
+        import signal
+        from liquidctl.daemon import Daemon
+        daemon = Daemon(REGISTRY, path=args['--socket'])
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    use_daemon = not args['--no-daemon']
+    all_devices = list(enumerate(find_all_supported_devices(use_daemon, args['--socket'])))
     if args['--dry-run']:
         for i, dev in all_devices:
             dev.dry_run = True
@@ -166,29 +334,47 @@ def main():
     if args['list']:
         _list_devices(selected, args)
         return
+    if args['apply']:
+        _apply_batch(selected, args)
+        return
+    if args['control']:
+        _control(selected, args)
+        return
+    if args['monitor']:
+        if not selected:
+            raise SystemExit('No devices matches available drivers and selection criteria')
+        _monitor(selected, args)
+        return
     if args['status']:
-        for i,dev in selected:
-            _device_get_status(dev, i)
+        failed = False
+        for num, dev, status, err in _run_on_devices(selected, _device_get_status, args):
+            if err:
+                LOGGER.error('Device %i, %s: %s', num, dev.description, err)
+                failed = True
+            else:
+                _print_status(dev, num, status)
+        if failed:
+            sys.exit(1)
         return
 
-    if len(selected) > 1:
-        raise SystemExit('Too many devices, filter or select one (see: liquidctl --help)')
+    if len(selected) > 1 and not args['--all']:
+        raise SystemExit('Too many devices, filter or select one, or use --all (see: liquidctl --help)')
     elif len(selected) == 0:
         raise SystemExit('No devices matches available drivers and selection criteria')
-    num, dev = selected[0]
 
-    dev.connect()
-    try:
-        if args['initialize']:
-            dev.initialize()
-        elif args['set'] and args['speed']:
-            _device_set_speed(dev, args)
-        elif args['set'] and args['color']:
-            _device_set_color(dev, args)
+    if len(selected) == 1:
+        num, dev = selected[0]
+        _device_apply(dev, args)
+        return
+    failed = False
+    for num, dev, _, err in _run_on_devices(selected, _device_apply, args):
+        if err:
+            LOGGER.error('Device %i, %s: %s', num, dev.description, err)
+            failed = True
         else:
-            raise Exception('Not sure what to do')
-    finally:
-        dev.disconnect()
+            LOGGER.info('Device %i, %s: done', num, dev.description)
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
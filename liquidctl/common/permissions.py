@@ -0,0 +1,109 @@
+"""Device node permissions (Linux).
+
+Checks whether the current user can access a device with a cheap `os.access`
+call, remembering the device nodes already known to be usable.  Access is
+best granted once, with udev rules for all supported devices:
+
+  python3 -m liquidctl.common.permissions            # print the rules
+  sudo python3 -m liquidctl.common.permissions --install
+
+Copyright (C) 2018  Jonas Malaco
+Copyright (C) 2018  each contribution's author
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import logging
+import os
+import sys
+
+
+LOGGER = logging.getLogger(__name__)
+
+UDEV_RULES_PATH = '/etc/udev/rules.d/71-liquidctl.rules'
+
+_usable = set()
+_warned = set()
+
+
+def device_node(device):
+    """Path of the device node for a USB device, or None if not applicable."""
+    if not sys.platform.startswith('linux'):
+        return None
+    return '/dev/bus/usb/{:03d}/{:03d}'.format(device.bus, device.address)
+
+
+def check_access(device):
+    """Check whether the current user can read and write to a device.
+
+    Devices without a node in /dev (e.g. simulated devices, or on other
+    platforms) are assumed to be accessible.  Nodes found to be usable are
+    remembered, and a hint is logged once for each node that is not.
+    """
+    path = device_node(device)
+    if path is None or path in _usable:
+        return True
+    if not os.path.exists(path) or os.access(path, os.R_OK | os.W_OK):
+        _usable.add(path)
+        return True
+    if path not in _warned:
+        _warned.add(path)
+        LOGGER.warning('no permission to access %s, install the udev rules with: '
+                       'sudo python3 -m liquidctl.common.permissions --install', path)
+    return False
+
+
+def forget(device):
+    """Forget any cached access information for a device."""
+    path = device_node(device)
+    _usable.discard(path)
+    _warned.discard(path)
+
+
+def generate_udev_rules(drivers):
+    """Generate udev rules granting the active user access to supported devices."""
+    lines = ['# liquidctl: give the active local user access to supported devices']
+    seen = set()
+    for driver in drivers:
+        for vid, pid, _, description, _ in driver.SUPPORTED_DEVICES:
+            if (vid, pid) in seen:
+                continue
+            seen.add((vid, pid))
+            lines.append('')
+            lines.append('# {}'.format(description))
+            lines.append('SUBSYSTEMS=="usb", ATTRS{{idVendor}}=="{:04x}", '
+                         'ATTRS{{idProduct}}=="{:04x}", TAG+="uaccess"'.format(vid, pid))
+    return '\n'.join(lines) + '\n'
+
+
+def install_udev_rules(drivers, path=UDEV_RULES_PATH):
+    """Install the udev rules and reload them (requires root)."""
+    with open(path, 'w') as f:
+        f.write(generate_udev_rules(drivers))
+    LOGGER.info('wrote %s', path)
+    import subprocess  # rarely needed, keep it out of the startup path
+    subprocess.call(['udevadm', 'control', '--reload-rules'])
+    subprocess.call(['udevadm', 'trigger', '--subsystem-match=usb'])
+    _usable.clear()
+    _warned.clear()
+
+
+if __name__ == '__main__':
+    from liquidctl.cli import REGISTRY
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if '--install' in sys.argv[1:]:
+        install_udev_rules(REGISTRY.drivers)
+    else:
+        sys.stdout.write(generate_udev_rules(REGISTRY.drivers))
@@ -41,6 +41,9 @@ class DeviceLightingPreset(QtCore.QObject):
     @property
     def device(self):
         return self.__device
+    @device.setter
+    def device(self, value):
+        self.__device = value
 
     @property
     def values(self):
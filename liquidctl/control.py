@@ -0,0 +1,300 @@
+"""Software control of fan and pump speeds.
+
+Following a temperature in software means writing to the device on every
+change of the computed duty.  A `Governor` filters these updates, so that
+sensor noise does not turn into a steady stream of USB writes: small duty
+steps and rapid updates are suppressed, and duty is only lowered once the
+temperature has dropped by some hysteresis.  Callers commit() each duty once
+it has been written, so that a failed write is retried on the next update.
+
+Duty can follow a static curve (`CurveControl`) or be driven by a PID
+controller towards a temperature setpoint (`PidControl`), and any number of
+channels can be run at a fixed rate by a `ControlLoop`.
+
+    >>> now = [0]  # manually advanced clock
+    >>> fan = CurveControl([(20, 25), (40, 60), (60, 100)], Governor(clock=lambda: now[0]))
+    >>> def follow(temperature):
+    ...     now[0] += 1
+    ...     duty = fan.update(temperature)
+    ...     if duty is not None:
+    ...         fan.governor.commit()  # written to the device
+    ...     return duty
+    >>> for i in range(100):
+    ...     _ = follow(40.3 + 0.1*(-1)**i)  # jitters between 60% and 61%
+    >>> fan.governor.sent, fan.governor.suppressed
+    (1, 99)
+    >>> follow(45)
+    70
+    >>> print(follow(44.5))  # lower, but within the hysteresis
+    None
+    >>> follow(43.9)
+    68
+
+Copyright (C) 2018  Jonas Malaco
+Copyright (C) 2018  each contribution's author
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import logging
+import threading
+import time
+
+from liquidctl.schedule import Ticker
+from liquidctl.util import CompiledProfile
+
+
+LOGGER = logging.getLogger(__name__)
+
+_DEFAULT_HYSTERESIS = 1.0  # °C
+_DEFAULT_MIN_STEP = 2      # %
+_DEFAULT_MAX_RATE = 1.0    # writes per second
+_DEFAULT_SLOPE_SMOOTHING = 0.5
+
+
+class Governor(object):
+    """Decide which duty updates of a channel are worth writing.
+
+    An update is suppressed if it:
+
+     - does not change the duty by at least `min_step`, unless it reaches
+       either end of the channel's `duty_range`;
+     - lowers the duty before the temperature has dropped by `hysteresis`
+       since the last write;
+     - comes less than 1/`max_rate` seconds after the last write (unless
+       `max_rate` is None).
+
+    Duties returned by update() only count as written once commit() is
+    called, after the write succeeds; until then, later updates are still
+    compared to the last committed write, so a failed write is retried.
+    Writes committed and updates suppressed are counted in `sent` and
+    `suppressed`.
+
+        >>> governor = Governor(max_rate=None)
+        >>> governor.update(50)
+        50
+        >>> governor.update(50)  # the write failed, and was not committed
+        50
+        >>> governor.commit(); print(governor.update(50))
+        None
+
+    Reaching the ends of `duty_range` is never held back by `min_step`:
+
+        >>> pump = Governor(max_rate=None, duty_range=(50, 100))
+        >>> pump.update(51); pump.commit()
+        51
+        >>> pump.update(50)
+        50
+    """
+
+    def __init__(self, hysteresis=_DEFAULT_HYSTERESIS, min_step=_DEFAULT_MIN_STEP,
+                 max_rate=_DEFAULT_MAX_RATE, duty_range=(0, 100), clock=time.monotonic):
+        self.hysteresis = hysteresis
+        self.min_step = min_step
+        self.max_rate = max_rate
+        self.duty_range = tuple(duty_range)
+        self.clock = clock
+        self.duty = None         # last duty written
+        self.temperature = None  # temperature at the last write
+        self.sent = 0
+        self.suppressed = 0
+        self._written_at = None
+        self._pending = None
+
+    def update(self, duty, temperature=None):
+        """Return `duty` if it should be written, or None if suppressed.
+
+        A returned duty must be committed once written, see commit().
+        """
+        now = self.clock()
+        if self.duty is not None and not self._worth_writing(duty, temperature, now):
+            self._pending = None
+            self.suppressed += 1
+            return None
+        self._pending = (duty, temperature, now)
+        return duty
+
+    def commit(self):
+        """Record that the duty last returned by update() has been written."""
+        if self._pending is None:
+            return
+        self.duty, self.temperature, self._written_at = self._pending
+        self._pending = None
+        self.sent += 1
+
+    def reset(self):
+        """Forget the last write, so that the next update is always written."""
+        self.duty = self.temperature = self._written_at = self._pending = None
+
+    def _worth_writing(self, duty, temperature, now):
+        if duty == self.duty:
+            return False
+        if abs(duty - self.duty) < self.min_step and duty not in self.duty_range:
+            return False
+        if duty < self.duty and temperature is not None and self.temperature is not None \
+                and temperature > self.temperature - self.hysteresis:
+            return False
+        if self.max_rate and now - self._written_at < 1/self.max_rate:
+            return False
+        return True
+
+
+class CurveControl(object):
+    """Follow a [(temperature, duty), ...] curve, writing through a governor.
+
+    Duties returned by update() must be committed to the governor once
+    written.
+    """
+
+    def __init__(self, curve, governor=None):
+        if not isinstance(curve, CompiledProfile):
+            curve = CompiledProfile(curve)
+        self.curve = curve
+        self.governor = governor or Governor()
+
+    def update(self, temperature):
+        """Return the duty to write for `temperature`, or None if not needed."""
+        return self.governor.update(self.curve(temperature), temperature)
+
+
+class PidControl(object):
+    """Drive duty to keep a temperature at `setpoint`, writing through a governor.
+
+    Duty is the sum of proportional (`kp`, in %/°C), integral (`ki`, in
+    %/°C·s) and derivative (`kd`, in %·s/°C) terms on the temperature error,
+    and of a feed-forward term (`kf`, in %·s/°C) on the slope of a
+    disturbance, like the temperature of the CPU heating the liquid.  Without
+    a disturbance, the feed-forward term follows the controlled temperature.
+    Slopes are smoothed by an exponential moving average.
+
+    Duty is clamped to `duty_range` (see duty_range()), and the integral
+    term stops accumulating while duty is saturated (anti-windup).  Duty is
+    not subject to the governor's hysteresis.
+
+        >>> now = [0]  # manually advanced clock
+        >>> pump = PidControl(35, kp=5, ki=0.5, duty_range=(50, 100), clock=lambda: now[0])
+        >>> for _ in range(60):
+        ...     if pump.update(40) is not None:
+        ...         pump.governor.commit()
+        ...     now[0] += 1
+        >>> pump.duty, pump.integral
+        (100, 75.0)
+        >>> pump.update(34)
+        70
+    """
+
+    def __init__(self, setpoint, kp, ki=0.0, kd=0.0, kf=0.0, duty_range=(0, 100),
+                 slope_smoothing=_DEFAULT_SLOPE_SMOOTHING, governor=None, clock=time.monotonic):
+        self.setpoint = setpoint
+        self.kp, self.ki, self.kd, self.kf = kp, ki, kd, kf
+        self.duty_range = duty_range
+        self.slope_smoothing = slope_smoothing
+        self.governor = governor or Governor(duty_range=duty_range, clock=clock)
+        self.clock = clock
+        self.integral = duty_range[0]
+        self.duty = None  # last computed duty, even if not written
+        self._last = None  # (time, temperature, disturbance)
+        self._slopes = [0.0, 0.0]  # temperature, disturbance
+
+    def update(self, temperature, disturbance=None):
+        """Return the duty to write for `temperature`, or None if not needed."""
+        now = self.clock()
+        if disturbance is None:
+            disturbance = temperature
+        if self._last is not None and now > self._last[0]:
+            dt = now - self._last[0]
+            a = self.slope_smoothing
+            for i, (value, last) in enumerate(zip((temperature, disturbance), self._last[1:])):
+                self._slopes[i] = a*self._slopes[i] + (1 - a)*(value - last)/dt
+        else:
+            dt = 0
+        self._last = (now, temperature, disturbance)
+        lo, hi = self.duty_range
+        error = temperature - self.setpoint
+        rest = self.kp*error + self.kd*self._slopes[0] + self.kf*self._slopes[1]
+        integral = self.integral + self.ki*error*dt
+        # anti-windup: do not integrate further into saturation
+        if (rest + integral > hi and error > 0) or (rest + integral < lo and error < 0):
+            integral = self.integral
+        self.integral = min(max(integral, lo), hi)
+        self.duty = min(max(round(rest + self.integral), lo), hi)
+        return self.governor.update(self.duty)
+
+
+class ControlLoop(object):
+    """Run control channels at a fixed rate, every `interval` seconds.
+
+    Each tick, every channel reads its temperature, updates its controller
+    and, if the controller asks for it, writes and commits the new duty.  A
+    failing channel is logged and skipped until the next tick, when a duty
+    that could not be written is tried again.
+
+        >>> writes = []
+        >>> def write(duty):
+        ...     writes.append(duty)
+        ...     if len(writes) == 1:
+        ...         raise OSError('device busy')
+        >>> loop = ControlLoop(1)
+        >>> loop.add('fan', lambda: 30, CurveControl([(20, 25), (40, 75)]), write)
+        >>> loop.step(); loop.step(); loop.step()
+        >>> writes, loop.channels[0][2].governor.sent
+        ([50, 50], 1)
+    """
+
+    def __init__(self, interval, clock=time.monotonic):
+        self.interval = interval
+        self.clock = clock
+        self.channels = []
+        self._stop = threading.Event()
+
+    def add(self, name, read, control, write, disturbance=None):
+        """Add a channel.
+
+        `read` and `disturbance` are called without arguments and return
+        temperatures; `control` is a CurveControl or a PidControl; and
+        `write` is called with the duty to write.
+        """
+        self.channels.append((name, read, control, write, disturbance))
+
+    def step(self):
+        """Run a single tick."""
+        for name, read, control, write, disturbance in self.channels:
+            try:
+                if disturbance:
+                    duty = control.update(read(), disturbance())
+                else:
+                    duty = control.update(read())
+                if duty is not None:
+                    write(duty)
+                    control.governor.commit()
+            except Exception as err:
+                LOGGER.warning('%s: control failed: %s', name, err)
+
+    def run(self):
+        """Run until stop() is called."""
+        self._stop.clear()
+        ticker = Ticker(self.interval, clock=self.clock, sleep=self._stop.wait)
+        for _ in ticker:
+            self.step()
+        if ticker.missed:
+            LOGGER.info('%i ticks missed', ticker.missed)
+
+    def stop(self):
+        """Stop a running loop."""
+        self._stop.set()
+
+
+def duty_range(device, channel):
+    """Get the (minimum, maximum) duty of a speed channel of `device`."""
+    return tuple(device.get_speed_channels()[channel][1:])
@@ -0,0 +1,512 @@
+"""Device-owning daemon, and transparent access to it.
+
+The daemon connects to all supported devices, keeps them claimed with their
+status drained by background readers, and serves requests from other
+processes over a Unix socket:
+
+    liquidctl daemon
+
+Clients find it with `find_daemon()`, which returns a registry of
+`RemoteDriver`s if it is running.  These implement the same API as the local
+drivers, so the CLI and GUI use the daemon transparently: commands need no
+enumeration or connection cycle, and never contend for the devices.
+
+The protocol is line-based JSON.  Each request is an object with `method`,
+and optionally `device`, `args` and `kwargs`; each response has either a
+`result` or an `error` with its `type` and `message`:
+
+    {"method":"list"}
+    {"device":"1:4","method":"set_fixed_speed","args":["fan",50]}
+
+The socket is created at `$LIQUIDCTL_SOCKET`, `$XDG_RUNTIME_DIR/liquidctl.sock`
+or `/tmp/liquidctl-<uid>/liquidctl.sock`, in this order of preference, and is
+only accessible to its owner by default.  Clients refuse sockets owned by
+other users, which could otherwise pose as the daemon.  Deadlines are
+`time.monotonic()` values, which are shared by all processes on Linux.
+
+Copyright (C) 2018  Jonas Malaco
+Copyright (C) 2018  each contribution's author
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import builtins
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import threading
+
+from liquidctl.driver.status import StatusRecord, StatusSchema
+
+
+LOGGER = logging.getLogger(__name__)
+
+_METHODS = {
+    'initialize', 'get_status', 'get_status_record', 'set_color', 'set_speed_profile',
+    'set_fixed_speed', 'set_instantaneous_speed', 'forget_state', 'get_color_modes',
+    'get_color_channels', 'get_animation_speeds', 'get_speed_channels', 'capabilities',
+    'status_age',
+}
+# plain constants and flags of the drivers, proxied as attributes of RemoteDriver
+_ATTRIBUTES = [
+    'DEVICE_KRAKENX', 'DEVICE_KRAKENM', 'LIQUID_TEMPERATURE', 'FAN_SPEED', 'PUMP_SPEED',
+    'FIRMWARE_VERSION', 'device_type', 'supports_lighting', 'supports_cooling',
+    'supports_cooling_profiles',
+]
+_SCALARS = (bool, int, float, str)
+_CONNECT_TIMEOUT = 0.5  # s
+
+
+def default_socket_path():
+    """Path of the daemon socket."""
+    path = os.environ.get('LIQUIDCTL_SOCKET')
+    if path:
+        return path
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        return os.path.join(runtime, 'liquidctl.sock')
+    return os.path.join(_fallback_dir(), 'liquidctl.sock')
+
+
+class Daemon(object):
+    """Own the devices in `registry` and serve requests for them at `path`."""
+
+    def __init__(self, registry, path=None, mode=0o600, hotplug=True):
+        self.registry = registry
+        self.path = path or default_socket_path()
+        self.mode = mode
+        self._devices = {}  # id -> (driver, lock)
+        self._lock = threading.Lock()
+        self._server = None
+        self._monitor = None
+        if hotplug:
+            from liquidctl.driver.hotplug import HotplugMonitor
+            self._monitor = HotplugMonitor(registry)
+
+    def start(self):
+        """Connect to the devices and bind the socket."""
+        if os.path.dirname(self.path) == _fallback_dir():
+            _private_dir(_fallback_dir())
+        if os.path.exists(self.path):
+            if _daemon_running(self.path):
+                raise RuntimeError('daemon already running at {}'.format(self.path))
+            os.unlink(self.path)
+        for dev in self.registry.devices():
+            self._attach(dev)
+        if self._monitor:
+            self._monitor.subscribe(self._hotplug)
+            self._monitor.start()
+        # bind with no access for others, only then widen it to self.mode
+        umask = os.umask(0o077)
+        try:
+            self._server = _Server(self.path, self)
+        finally:
+            os.umask(umask)
+        os.chmod(self.path, self.mode)
+        LOGGER.info('listening on %s', self.path)
+
+    def serve_forever(self):
+        """Handle requests until `shutdown()` (or an exception, like SystemExit)."""
+        if not self._server:
+            self.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self.close()
+
+    def shutdown(self):
+        """Stop serving requests; must be called from another thread."""
+        self._server.shutdown()
+
+    def close(self):
+        if self._monitor:
+            self._monitor.stop()
+        if self._server:
+            self._server.server_close()
+            self._server = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        with self._lock:
+            devices, self._devices = list(self._devices.values()), {}
+        for dev, lock in devices:
+            with lock:
+                _disconnect(dev)
+
+    def handle(self, request):
+        """Handle a decoded request, returning the response object."""
+        try:
+            return {'result': self._dispatch(request)}
+        except Exception as err:
+            LOGGER.debug('request failed: %r', request, exc_info=True)
+            if isinstance(err, OSError) and err.strerror:
+                message = err.strerror  # errno is sent on its own
+            else:
+                message = err.args[0] if len(err.args) == 1 else str(err)
+            return {'error': {'type': type(err).__name__, 'message': str(message),
+                              'errno': getattr(err, 'errno', None)}}
+
+    def _dispatch(self, request):
+        method = request.get('method')
+        if method == 'list':
+            with self._lock:
+                return [_describe(key, dev) for key, (dev, _) in self._devices.items()]
+        if method not in _METHODS:
+            raise ValueError('unknown method {}'.format(method))
+        with self._lock:
+            if request.get('device') not in self._devices:
+                raise LookupError('no device {}'.format(request.get('device')))
+            dev, lock = self._devices[request['device']]
+        with lock:
+            attr = getattr(dev, method)
+            res = attr(*request.get('args', []), **request.get('kwargs', {})) if callable(attr) else attr
+        if isinstance(res, StatusRecord):
+            return {'values': res.values, 'timestamp': res.timestamp, 'partial': res.partial}
+        return res
+
+    def _attach(self, dev):
+        try:
+            dev.connect(session=True)
+            dev.start_background_reader()
+        except Exception as err:
+            LOGGER.warning('failed to connect to %s: %s', dev.description, err)
+            _disconnect(dev)
+            return
+        with self._lock:
+            self._devices[_device_id(dev)] = (dev, threading.Lock())
+        LOGGER.info('serving %s', dev.description)
+
+    def _hotplug(self, event, dev):
+        if event == 'add':
+            self._attach(dev)
+            return
+        with self._lock:
+            entry = self._devices.pop(_device_id(dev), None)
+        if entry:
+            with entry[1]:
+                _disconnect(dev)
+            LOGGER.info('lost %s', dev.description)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+            except ValueError as err:
+                response = {'error': {'type': 'ValueError', 'message': str(err)}}
+            else:
+                response = self.server.daemon.handle(request)
+            self.wfile.write(_encode(response))
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, daemon):
+        self.daemon = daemon
+        super().__init__(path, _Handler)
+
+
+class DaemonClient(object):
+    """Connection to the daemon at `path`; safe to share between threads."""
+
+    def __init__(self, path=None, timeout=None):
+        self.path = path or default_socket_path()
+        _check_owner(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(self.path)
+        self._file = self._sock.makefile('rwb')
+        self._lock = threading.Lock()
+
+    def call(self, method, device=None, *args, **kwargs):
+        """Call `method` (of `device`, if set) and return its result."""
+        request = {'method': method, 'args': args, 'kwargs': kwargs}
+        if device is not None:
+            request['device'] = device
+        with self._lock:
+            self._file.write(_encode(request))
+            self._file.flush()
+            line = self._file.readline()
+        if not line:
+            raise ConnectionError('daemon closed the connection')
+        response = json.loads(line.decode('utf-8'))
+        if 'error' in response:
+            raise _remote_error(response['error'])
+        return response['result']
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+class RemoteUsbDevice(object):
+    """Attributes of a USB device owned by the daemon."""
+
+    def __init__(self, info):
+        for attr in ['idVendor', 'idProduct', 'bcdDevice', 'bus', 'address', 'port_number',
+                     'serial_number']:
+            setattr(self, attr, info.get(attr))
+
+
+class RemoteDriver(object):
+    """Proxy to a driver in the daemon, with the same API as the local ones.
+
+    Connections are managed by the daemon: `connect`, `disconnect` and the
+    background reader methods only track the session state locally.
+    """
+
+    def __init__(self, client, info):
+        self.client = client
+        self.id = info['id']
+        self.description = info['description']
+        self.device = RemoteUsbDevice(info)
+        self.dry_run = False
+        self._session = False
+        self._schema = StatusSchema(info['schema']) if info.get('schema') else None
+        self._constant = {}  # results that cannot change
+        for name, value in info.get('attributes', {}).items():
+            if name in _ATTRIBUTES and isinstance(value, _SCALARS):
+                setattr(self, name, value)
+
+    def __repr__(self):
+        return 'RemoteDriver({!r}, {!r})'.format(self.id, self.description)
+
+    def connect(self, session=False):
+        self._session = session
+
+    def disconnect(self):
+        self._session = False
+
+    def __enter__(self):
+        self.connect(session=True)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disconnect()
+
+    @property
+    def in_session(self):
+        return self._session
+
+    def start_background_reader(self):
+        pass
+
+    def stop_background_reader(self):
+        pass
+
+    def initialize(self, **kwargs):
+        return self._set('initialize', **kwargs)
+
+    def get_status(self, deadline=None):
+        return [tuple(item) for item in self._call('get_status', deadline=deadline)]
+
+    def get_status_record(self, deadline=None):
+        res = self._call('get_status_record', deadline=deadline)
+        return StatusRecord(self._schema, res['values'], res['timestamp'], res['partial'])
+
+    @property
+    def status_schema(self):
+        return self._schema
+
+    @property
+    def status_age(self):
+        return self._call('status_age')
+
+    @property
+    def capabilities(self):
+        return self._call('capabilities')
+
+    def set_color(self, channel, mode, colors, speed, **kwargs):
+        return self._set('set_color', channel, mode, [list(c) for c in colors], speed, **kwargs)
+
+    def set_speed_profile(self, channel, profile, **kwargs):
+        return self._set('set_speed_profile', channel, [list(p) for p in profile], **kwargs)
+
+    def set_fixed_speed(self, channel, speed, **kwargs):
+        return self._set('set_fixed_speed', channel, speed, **kwargs)
+
+    def set_instantaneous_speed(self, channel, speed, **kwargs):
+        return self._set('set_instantaneous_speed', channel, speed, **kwargs)
+
+    def forget_state(self):
+        return self._call('forget_state')
+
+    def get_color_modes(self):
+        return self._cached('get_color_modes')
+
+    def get_color_channels(self):
+        return self._cached('get_color_channels')
+
+    def get_animation_speeds(self):
+        return self._cached('get_animation_speeds')
+
+    def get_speed_channels(self):
+        return self._cached('get_speed_channels')
+
+    def _call(self, method, *args, **kwargs):
+        return self.client.call(method, self.id, *args, **kwargs)
+
+    def _set(self, method, *args, **kwargs):
+        if self.dry_run:
+            LOGGER.info('dry run, not sending %s%r to the daemon', method, args)
+            return None
+        return self._call(method, *args, **kwargs)
+
+    def _cached(self, method):
+        if method not in self._constant:
+            self._constant[method] = self._call(method)
+        return self._constant[method]
+
+
+class RemoteRegistry(object):
+    """Registry of the devices served by the daemon (see `DeviceRegistry`)."""
+
+    def __init__(self, client):
+        self.client = client
+        self._devices = None
+        self._lock = threading.RLock()
+
+    def devices(self):
+        with self._lock:
+            if self._devices is None:
+                self._devices = self._fetch()
+            return list(self._devices)
+
+    def update(self):
+        with self._lock:
+            current = {dev.id: dev for dev in self.devices()}
+            new = {dev.id: dev for dev in self._fetch()}
+            removed = [dev for key, dev in current.items() if key not in new]
+            added = [dev for key, dev in new.items() if key not in current]
+            self._devices = [dev for dev in current.values() if dev not in removed] + added
+            return added, removed
+
+    def refresh(self):
+        self.invalidate()
+        return self.devices()
+
+    def invalidate(self):
+        with self._lock:
+            self._devices = None
+
+    def _fetch(self):
+        return [RemoteDriver(self.client, info) for info in self.client.call('list')]
+
+
+def find_daemon(path=None):
+    """Get a `RemoteRegistry` if the daemon is running, or None."""
+    path = path or default_socket_path()
+    if not os.path.exists(path):
+        return None
+    try:
+        client = DaemonClient(path, timeout=_CONNECT_TIMEOUT)
+        client.call('list')
+    except PermissionError as err:
+        LOGGER.warning('ignoring daemon socket: %s', err)
+        return None
+    except OSError as err:
+        LOGGER.debug('daemon not available at %s: %s', path, err)
+        return None
+    client._sock.settimeout(None)
+    LOGGER.debug('using daemon at %s', path)
+    return RemoteRegistry(client)
+
+
+def _daemon_running(path):
+    try:
+        DaemonClient(path, timeout=_CONNECT_TIMEOUT).close()
+        return True
+    except OSError:
+        return False
+
+
+def _check_owner(path):
+    """Raise PermissionError unless `path` is a socket owned by the current user."""
+    info = os.stat(path)
+    if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError('{} is not a socket owned by the current user'.format(path))
+
+
+def _fallback_dir():
+    return '/tmp/liquidctl-{}'.format(os.getuid())
+
+
+def _private_dir(path):
+    """Create `path` only accessible to the current user, or check that it is."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.stat(path)
+    if info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError('{} must be private to the current user'.format(path))
+
+
+def _device_id(dev):
+    return '{}:{}'.format(dev.device.bus, dev.device.address)
+
+
+def _describe(key, dev):
+    und = dev.device
+    info = {'id': key, 'description': dev.description, 'driver': type(dev).__name__}
+    for attr in ['idVendor', 'idProduct', 'bcdDevice', 'bus', 'address', 'port_number']:
+        info[attr] = getattr(und, attr, None)
+    try:
+        info['serial_number'] = und.serial_number
+    except Exception:
+        info['serial_number'] = None
+    schema = dev.status_schema
+    info['schema'] = list(zip(schema.keys, schema.units))
+    info['attributes'] = {}
+    for name in _ATTRIBUTES:
+        try:
+            value = getattr(dev, name)
+        except AttributeError:
+            continue
+        except Exception as err:
+            # computed flags, like supports_cooling_profiles, may need the device
+            LOGGER.debug('failed to get %s of %s: %s', name, dev.description, err)
+            continue
+        if isinstance(value, _SCALARS):
+            info['attributes'][name] = value
+    return info
+
+
+def _disconnect(dev):
+    try:
+        dev.disconnect()
+    except Exception as err:
+        LOGGER.debug('failed to disconnect from %s: %s', dev.description, err)
+
+
+def _encode(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def _remote_error(error):
+    """Rebuild an exception raised in the daemon, if it is a builtin or a USB error.
+
+    USB errors keep their errno, so that timeouts can still be told apart.
+    """
+    name, message, code = error.get('type', ''), error.get('message'), error.get('errno')
+    if name in ('USBError', 'USBTimeoutError'):
+        import usb.core
+        return getattr(usb.core, name, usb.core.USBError)(message, errno=code)
+    cls = getattr(builtins, name, None)
+    if not (isinstance(cls, type) and issubclass(cls, Exception)):
+        return RuntimeError('{}: {}'.format(name, message))
+    if issubclass(cls, OSError) and code is not None:
+        return cls(code, message)
+    return cls(message)
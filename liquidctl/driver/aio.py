@@ -0,0 +1,155 @@
+"""asyncio facade for the USB drivers.
+
+Wraps any driver so that its operations can be awaited:
+
+    devices = await find_all_supported_devices([KrakenTwoDriver, NzxtSmartDeviceDriver])
+    for dev in devices:
+        await dev.connect(session=True)
+    statuses = await asyncio.gather(*(dev.get_status() for dev in devices))
+
+Blocking USB transfers are dispatched to a shared, bounded thread pool.
+Operations on the same device run one at a time, in the order they were
+requested, while different devices proceed concurrently.
+
+A `timeout` (in seconds) can be set per driver or per call, and includes the
+time spent waiting for earlier operations on the same device.  Because USB
+transfers cannot be interrupted once started, a cancelled or timed out
+operation keeps the device busy until the underlying transfer ends; only then
+will the next operation on that device start.  Status requests pass what is
+left of their timeout down to the driver as a deadline, and prefer returning a
+record flagged `partial` to timing out, unless the device stays busy with
+other operations for all of it.
+
+Copyright (C) 2018  Jonas Malaco
+Copyright (C) 2018  each contribution's author
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import threading
+import time
+
+
+_MAX_WORKERS = 8
+_DEADLINE_GRACE = 0.1  # s; for the driver to return a partial status
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Get the thread pool shared by all async drivers."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=_MAX_WORKERS, thread_name_prefix='liquidctl')
+        return _executor
+
+
+class AsyncDriver(object):
+    """Awaitable wrapper for a `BaseUsbDriver` instance."""
+
+    def __init__(self, driver, executor=None, timeout=None):
+        self.driver = driver
+        self.timeout = timeout
+        self._executor = executor
+        self._lock = None  # created lazily, in the running loop
+
+    def __getattr__(self, name):
+        # expose plain attributes like description and device
+        return getattr(self.driver, name)
+
+    async def connect(self, session=False, timeout=None):
+        return await self._run(self.driver.connect, session, timeout=timeout)
+
+    async def disconnect(self, timeout=None):
+        return await self._run(self.driver.disconnect, timeout=timeout)
+
+    async def initialize(self, timeout=None):
+        return await self._run(self.driver.initialize, timeout=timeout)
+
+    async def get_status(self, timeout=None):
+        return await self._run_until(self.driver.get_status, timeout)
+
+    async def get_status_record(self, timeout=None):
+        return await self._run_until(self.driver.get_status_record, timeout)
+
+    async def set_color(self, channel, mode, colors, speed, force=False, timeout=None):
+        colors = list(colors)
+        return await self._run(self.driver.set_color, channel, mode, colors, speed, force,
+                               timeout=timeout)
+
+    async def set_speed_profile(self, channel, profile, force=False, timeout=None):
+        profile = list(profile)
+        return await self._run(self.driver.set_speed_profile, channel, profile, force,
+                               timeout=timeout)
+
+    async def set_fixed_speed(self, channel, speed, force=False, timeout=None):
+        return await self._run(self.driver.set_fixed_speed, channel, speed, force,
+                               timeout=timeout)
+
+    async def set_instantaneous_speed(self, channel, speed, force=False, timeout=None):
+        return await self._run(self.driver.set_instantaneous_speed, channel, speed, force,
+                               timeout=timeout)
+
+    async def _run(self, func, *args, timeout=None):
+        timeout = timeout if timeout is not None else self.timeout
+        # the timeout covers waiting for earlier operations on the device too
+        return await asyncio.wait_for(self._locked(functools.partial(func, *args)), timeout)
+
+    async def _run_until(self, func, timeout):
+        timeout = timeout if timeout is not None else self.timeout
+        if timeout is None:
+            return await self._run(func)
+        deadline = time.monotonic() + timeout
+        return await asyncio.wait_for(self._locked(func, deadline=deadline),
+                                      timeout + _DEADLINE_GRACE)
+
+    async def _locked(self, func, deadline=None):
+        loop = asyncio.get_running_loop()
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        await self._lock.acquire()
+        try:
+            if deadline is not None:
+                # set once the device is ours, the deadline leaves the driver
+                # whatever is left of the timeout after waiting for the lock
+                func = functools.partial(func, deadline=deadline)
+            fut = loop.run_in_executor(self._executor or get_executor(), func)
+        except:
+            self._lock.release()
+            raise
+        # release the device only when the transfer actually ends, even if the
+        # caller stops waiting for it, so that per-device ordering is preserved
+        fut.add_done_callback(self._transfer_done)
+        return await asyncio.shield(fut)
+
+    def _transfer_done(self, fut):
+        self._lock.release()
+        if not fut.cancelled():
+            fut.exception()  # retrieved, even if the caller gave up on it
+
+
+async def find_all_supported_devices(drivers, executor=None, timeout=None, **kwargs):
+    """Find devices supported by `drivers` and wrap them in `AsyncDriver`s."""
+    loop = asyncio.get_running_loop()
+    executor = executor or get_executor()
+    found = await asyncio.gather(*(
+        loop.run_in_executor(executor, functools.partial(drv.find_supported_devices, **kwargs))
+        for drv in drivers))
+    return [AsyncDriver(dev, executor=executor, timeout=timeout)
+            for devs in found for dev in devs]
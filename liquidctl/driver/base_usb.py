@@ -17,15 +17,25 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import sys, os
+import collections
+import contextlib
+import sys
 import logging
+import time
 
 import usb.core
 import usb.util
 
+from liquidctl.common import permissions
+from liquidctl.driver import capabilities, capture
+from liquidctl.driver.latency import LatencyTracker, remaining
+from liquidctl.driver.reader import BackgroundReader, is_timeout
+
 
 LOGGER = logging.getLogger(__name__)
 
+_REPORT_MAX_AGE = 2.0  # s, cached reports older than this are stale
+
 class BaseUsbDriver(object):
     """Base driver class for USB devices.
 
@@ -34,6 +44,15 @@ class BaseUsbDriver(object):
 
     SUPPORTED_DEVICES should consist of a list of tuples (vendor id, product
     id, device release range, description, kwargs).
+
+    Drivers keep a shadow copy of the last state successfully applied to each
+    channel, and skip requests that would not change it; `force=True` can be
+    passed to the set_* methods to write regardless.
+
+    Transfer timeouts adapt to the latencies observed on each endpoint.
+    Callers can also bound an operation with a `deadline`, a `time.monotonic()`
+    value: status is then returned flagged as `partial` once it expires, while
+    set_* methods raise `TimeoutError`.
     """
 
     SUPPORTED_DEVICES = []
@@ -44,31 +63,51 @@ class BaseUsbDriver(object):
         self.description = description
         self.dry_run = False
         self._should_reattach_kernel_driver = False
-
-        if sys.platform.startswith('linux'):
-            path = "/dev/bus/usb/%03d/%03d" % (self.device.bus, self.device.address)
-            os.system('python3 %s/liquidctl/common/setperms.py %s' % (os.getcwd(), path) )
+        self._session = False
+        self._reader = None
+        self._shadow = {}
+        self.writes_saved = 0  # writes skipped thanks to the shadow state
+        self.trace = None  # optional TransferTrace
+        self._capture = None
+        self.capability_cache = capabilities.get_cache()
+        self._capabilities = None  # loaded lazily
+        self._latency = collections.defaultdict(LatencyTracker)  # per endpoint
+        permissions.check_access(self.device)
 
     @classmethod
-    def find_supported_devices(cls):
+    def find_supported_devices(cls, backend=None):
         """Find compatible devices and return corresponding driver instances.
 
+        Devices are searched with `usb.core`, unless some other `backend` with
+        a compatible `find` function is passed (e.g. a `SimulatedBackend`).
+
         Returns a list of driver class instances.
         """
+        backend = backend or usb.core
         drivers = []
         for vid, pid, ver, description, kwargs in cls.SUPPORTED_DEVICES:
-            usbdevs = usb.core.find(idVendor=vid, idProduct=pid, find_all=True)
+            usbdevs = backend.find(idVendor=vid, idProduct=pid, find_all=True)
             for dev in usbdevs:
                 if ver and (dev.bcdDevice < ver[0] or dev.bcdDevice > ver[1]):
                     continue
                 drivers.append(cls(dev, description, **kwargs))
         return drivers
 
-    def connect(self):
+    def connect(self, session=False):
         """Connect to the device.
 
         Replace the kernel driver (Linux only) and set the device configuration
         to the first available one, if none has been set.
+
+        By default resources are released after every operation, which suits
+        one-shot callers like the CLI.  With `session=True` the interface is
+        kept claimed until `disconnect()`, sparing long-lived callers (GUIs,
+        control loops) from releasing and re-claiming it on every transfer.
+
+        The driver can also be used as a context manager, which connects in
+        session mode and disconnects on exit.
+
+        Connecting again does not end a session already in progress.
         """
         if sys.platform.startswith('linux') and self.device.is_kernel_driver_active(0):
             LOGGER.debug('detaching currently active kernel driver')
@@ -78,16 +117,175 @@ class BaseUsbDriver(object):
         if cfg is None:
             LOGGER.debug('setting the (first) configuration')
             self.device.set_configuration()
+        self._session = self._session or session
 
     def disconnect(self):
         """Disconnect from the device.
 
-        Clean up and (Linux only) reattach the kernel driver.
+        Clean up, end any session and (Linux only) reattach the kernel driver.
         """
+        self.stop_background_reader()
+        self.stop_capture()
+        self._session = False
         usb.util.dispose_resources(self.device)
         if self._should_reattach_kernel_driver:
             LOGGER.debug('reattaching previously active kernel driver')
             self.device.attach_kernel_driver(0)
+            self._should_reattach_kernel_driver = False
+
+    def __enter__(self):
+        self.connect(session=True)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disconnect()
+
+    @property
+    def in_session(self):
+        """Whether the interface is being kept claimed between operations."""
+        return self._session
+
+    def start_background_reader(self):
+        """Continuously read status reports in a background thread.
+
+        Subsequent calls to `get_status` will be answered from the latest
+        reports received, without waiting on USB transfers; their age can be
+        checked with `status_age`.
+
+        Requires the device to be connected in session mode.  The reader is
+        stopped on `disconnect()` or with `stop_background_reader()`.
+        """
+        if self._reader:
+            return
+        if not self._session:
+            raise RuntimeError('background reader requires a session, see connect(session=True)')
+        name = 'liquidctl reader ({})'.format(self.description)
+        self._reader = BackgroundReader(self._read_report, self._report_channel, name=name)
+        self._reader.start()
+
+    def stop_background_reader(self):
+        """Stop the background reader, if one is running."""
+        if self._reader:
+            self._reader.stop()
+            self._reader = None
+
+    @property
+    def status_age(self):
+        """Seconds since the oldest cached status report, or None.
+
+        Only available while a background reader is running.
+        """
+        return self._reader.age() if self._reader else None
+
+    def start_capture(self, path):
+        """Start capturing all transfers to a file (see `liquidctl.driver.capture`)."""
+        self.stop_capture()
+        self._capture = capture.CaptureWriter(path, self.device)
+
+    def stop_capture(self):
+        """Stop capturing transfers, if a capture is in progress."""
+        if self._capture:
+            self._capture.close()
+            self._capture = None
+
+    def _usb_read(self, endpoint, length, timeout):
+        """Read from an endpoint, tracing and logging the data received."""
+        start = time.perf_counter()
+        with self._tracking(endpoint):
+            if self._capture:
+                msg = self._captured(self.device.read, endpoint, length, timeout)
+            else:
+                msg = self.device.read(endpoint, length, timeout)
+        self._latency[endpoint].record(time.perf_counter() - start)
+        if self.trace is not None:
+            self.trace.record(endpoint, msg)
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug('received %s', ' '.join(format(i, '02x') for i in msg))
+        return msg
+
+    def _usb_write(self, endpoint, data, length, timeout):
+        """Write `data` padded to `length` bytes, tracing and logging it."""
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug('write %s (and %i padding bytes)',
+                         ' '.join(format(i, '02x') for i in data), length - len(data))
+        if self.dry_run:
+            return
+        packet = bytearray(length)
+        packet[:len(data)] = data
+        if self.trace is not None:
+            self.trace.record(endpoint, packet)
+        start = time.perf_counter()
+        with self._tracking(endpoint):
+            if self._capture:
+                self._captured(self.device.write, endpoint, packet, timeout)
+            else:
+                self.device.write(endpoint, packet, timeout)
+        self._latency[endpoint].record(time.perf_counter() - start)
+
+    @contextlib.contextmanager
+    def _tracking(self, endpoint):
+        """Forget the latencies learned on `endpoint` if a transfer times out."""
+        try:
+            yield
+        except usb.core.USBError as err:
+            if is_timeout(err):
+                self._latency[endpoint].timed_out()
+            raise
+
+    def _captured(self, transfer, endpoint, arg, timeout):
+        start = time.perf_counter()
+        try:
+            res = transfer(endpoint, arg, timeout)
+        except usb.core.USBError as err:
+            status = capture.STATUS_TIMEOUT if is_timeout(err) else capture.STATUS_ERROR
+            self._capture.record(endpoint, b'', start, time.perf_counter() - start, status)
+            raise
+        data = res if endpoint & 0x80 else arg
+        self._capture.record(endpoint, data, start, time.perf_counter() - start)
+        return res
+
+    def _transfer_timeout(self, endpoint, default, deadline=None, adaptive=True):
+        """Timeout, in milliseconds, for a transfer on `endpoint`.
+
+        Adapted to the latencies observed on the endpoint (unless `adaptive` is
+        false), without exceeding `default` or the time left until `deadline`.
+        Raises `TimeoutError` if the deadline has already passed.
+        """
+        timeout = self._latency[endpoint].timeout(default) if adaptive else default
+        if deadline is not None:
+            timeout = min(timeout, remaining(deadline))
+        return timeout
+
+    def _latest_reports(self, count, deadline=None, max_age=_REPORT_MAX_AGE):
+        """Get the latest reports cached by the background reader.
+
+        Waits until reports for `count` channels have been received, or until
+        `deadline` (by default, for up to `max_age` seconds), but never for
+        reports to be renewed: a device that stopped reporting must not hold
+        up its caller.
+
+        Returns (reports, timestamp, stale): `timestamp` is when the oldest
+        report was received, and `stale` whether it is older than `max_age`.
+        """
+        timeout = max_age if deadline is None else max(0, deadline - time.monotonic())
+        pairs = self._reader.latest(count, timeout)
+        if not pairs:
+            return [], None, False
+        timestamp = min(received for _, received in pairs)
+        return [msg for msg, _ in pairs], timestamp, time.time() - timestamp > max_age
+
+    def _read_report(self, timeout):
+        """Read a single raw status report."""
+        raise NotImplementedError()
+
+    def _report_channel(self, msg):
+        """Channel a raw status report refers to."""
+        return 0
+
+    def _release(self):
+        """Release the device resources, unless in session mode."""
+        if not self._session:
+            usb.util.dispose_resources(self.device)
 
     def initialize(self):
         """Initialize the device.
@@ -101,26 +299,92 @@ class BaseUsbDriver(object):
         """
         pass
 
-    def get_status(self):
+    def get_status(self, deadline=None):
         """Get a status report.
 
         Returns a list of (key, value, unit) tuples.
         """
+        return list(self.get_status_record(deadline=deadline))
+
+    def get_status_record(self, deadline=None):
+        """Get a status report.
+
+        Returns a `StatusRecord` following `status_schema`; if `deadline`
+        expires before all reports are read, the record is flagged `partial`.
+        """
+        raise NotImplementedError()
+
+    @property
+    def status_schema(self):
+        """The `StatusSchema` of the status records reported by the device."""
         raise NotImplementedError()
-        return []
 
-    def set_color(self, channel, mode, colors, speed):
+    def set_color(self, channel, mode, colors, speed, force=False, deadline=None):
         """Set the color mode for a specific channel."""
         raise NotImplementedError()
 
-    def set_speed_profile(self, channel, profile):
+    def set_speed_profile(self, channel, profile, force=False, deadline=None):
         """Set channel to use a speed profile."""
         raise NotImplementedError()
 
-    def set_fixed_speed(self, channel, speed):
+    def set_fixed_speed(self, channel, speed, force=False, deadline=None):
         """Set channel to a fixed speed."""
         raise NotImplementedError()
 
+    def forget_state(self):
+        """Forget the states applied so far, so that they will be rewritten.
+
+        Useful if the device might have lost them, e.g. after power loss.
+        """
+        self._shadow.clear()
+
+    def _unchanged(self, key, state, force=False, writes=1):
+        """Whether `state`, taking `writes` to apply, is already applied to `key`.
+
+        If not, the shadow state of `key` is invalidated, as a write that fails
+        midway leaves it unknown.
+        """
+        if force or self.dry_run or self._shadow.get(key) != state:
+            if not self.dry_run:
+                self._shadow.pop(key, None)
+            return False
+        LOGGER.debug('skipping %s %s: unchanged', *key)
+        self.writes_saved += writes
+        return True
+
+    def _applied(self, key, state):
+        """Record that `state` was successfully applied to `key`."""
+        if not self.dry_run:
+            self._shadow[key] = state
+
+    @property
+    def capabilities(self):
+        """Capabilities learned so far, possibly in previous runs.
+
+        See `liquidctl.driver.capabilities`.
+        """
+        return dict(self._known_capabilities())
+
+    def _known_capabilities(self):
+        if self._capabilities is None:
+            cache = self.capability_cache
+            self._capabilities = cache.get(self.device) if cache else {}
+        return self._capabilities
+
+    def _learn(self, **caps):
+        """Record capabilities learned from the device, persisting any changes."""
+        known = self._known_capabilities()
+        caps = {k: list(v) if isinstance(v, tuple) else v for k, v in caps.items()}
+        firmware = caps.get('firmware_version')
+        if firmware and known.get('firmware_version') not in (None, firmware):
+            LOGGER.info('firmware version changed, discarding cached capabilities')
+            known.clear()
+        if all(known.get(k) == v for k, v in caps.items()):
+            return
+        known.update(caps)
+        if self.capability_cache:
+            self.capability_cache.put(self.device, known)
+
     def get_color_modes(self):
         """Get list of color modes available to device"""
         raise NotImplementedError()
@@ -131,4 +395,8 @@ class BaseUsbDriver(object):
 
     def get_animation_speeds(self):
         """Get list of speeds for the color animation"""
-        return NotImplementedError()
\ No newline at end of file
+        return NotImplementedError()
+
+    def get_speed_channels(self):
+        """Get list of speed channels available to device"""
+        raise NotImplementedError()
\ No newline at end of file
@@ -0,0 +1,135 @@
+"""Persistent cache of device capabilities.
+
+Some capabilities, like the firmware version or whether a Kraken supports
+cooling profiles, can only be learned by reading from the device.  They are
+kept on disk, keyed by vendor and product ids, device release (bcdDevice) and
+the bus and port path of the device, so that later runs need no USB
+round-trips to find them; the key itself only uses information already in
+the device descriptor.
+
+Drivers refresh the cache as a side effect of reading status reports; when a
+different firmware version is seen, all cached capabilities of that device
+are discarded.  Only capabilities that drivers read back are cached.
+
+The cache is a small JSON file, by default in
+`$XDG_CACHE_HOME/liquidctl/capabilities.json`.  Only devices on the real bus
+whose port path is known are cached; simulated and replayed devices are not.
+
+Copyright (C) 2018  Jonas Malaco
+Copyright (C) 2018  each contribution's author
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import json
+import logging
+import os
+import threading
+
+import usb.core
+
+
+LOGGER = logging.getLogger(__name__)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def default_path():
+    """Default location of the capability cache."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'liquidctl', 'capabilities.json')
+
+
+def get_cache():
+    """Get the capability cache shared by all drivers."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CapabilityCache()
+        return _cache
+
+
+class CapabilityCache(object):
+    """Capabilities of devices, persisted to a JSON file at `path`."""
+
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        self._entries = None  # loaded lazily
+        self._lock = threading.Lock()
+
+    def key(self, device):
+        """Cache key of a USB device, or None if it cannot be cached."""
+        if not isinstance(device, usb.core.Device):
+            return None
+        ports = getattr(device, 'port_numbers', None)
+        if device.bus is None or not ports:
+            return None
+        return '{:04x}:{:04x}:{:04x}@{}-{}'.format(device.idVendor, device.idProduct,
+                                                   device.bcdDevice, device.bus,
+                                                   '.'.join(map(str, ports)))
+
+    def get(self, device):
+        """Get the cached capabilities of `device` (possibly an empty dict)."""
+        key = self.key(device)
+        if key is None:
+            return {}
+        with self._lock:
+            return dict(self._load().get(key, {}))
+
+    def put(self, device, capabilities):
+        """Replace the cached capabilities of `device`."""
+        key = self.key(device)
+        if key is None:
+            return
+        with self._lock:
+            entries = self._load()
+            if entries.get(key) == capabilities:
+                return
+            entries[key] = dict(capabilities)
+            self._save(entries)
+
+    def invalidate(self, device):
+        """Discard the cached capabilities of `device`."""
+        key = self.key(device)
+        if key is None:
+            return
+        with self._lock:
+            entries = self._load()
+            if entries.pop(key, None) is not None:
+                self._save(entries)
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path) as f:
+                    self._entries = json.load(f)
+            except FileNotFoundError:
+                self._entries = {}
+            except (OSError, ValueError) as err:
+                LOGGER.warning('ignoring capability cache %s: %s', self.path, err)
+                self._entries = {}
+        return self._entries
+
+    def _save(self, entries):
+        import tempfile  # only needed when capabilities change
+        try:
+            directory = os.path.dirname(self.path)
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.capabilities')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        except OSError as err:
+            LOGGER.debug('failed to write capability cache %s: %s', self.path, err)
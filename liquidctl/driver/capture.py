@@ -0,0 +1,104 @@
+"""Capture of USB transfers to files.
+
+A capture records every transfer of a driver (endpoint, direction, payload,
+time and duration) to a compact binary file:
+
+    dev.start_capture('kraken.lqcap')
+    ...
+    dev.stop_capture()
+
+They can then be replayed with `liquidctl.driver.replay`.
+
+File format (little endian):
+
+    header:  magic 'LQCAP', version (u8), idVendor, idProduct, bcdDevice
+             (u16 each), serial number length (u8), serial number (utf-8)
+    records: time since start (f64, seconds), duration (f32, seconds),
+             endpoint (u8), status (u8), payload length (u16), payload
+
+Copyright (C) 2018  Jonas Malaco
+Copyright (C) 2018  each contribution's author
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import collections
+import struct
+import threading
+import time
+
+import usb.core
+
+
+MAGIC = b'LQCAP'
+VERSION = 1
+STATUS_OK = 0
+STATUS_TIMEOUT = 1
+STATUS_ERROR = 2
+
+_HEADER = struct.Struct('<5sBHHHB')
+_RECORD = struct.Struct('<dfBBH')
+
+Transfer = collections.namedtuple('Transfer', 'time duration endpoint status data')
+
+
+class CaptureWriter(object):
+    """Write transfers of `device` to a capture file at `path`."""
+
+    def __init__(self, path, device):
+        self._file = open(path, 'wb')
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        serial = (_serial_number(device) or '').encode('utf-8')[:255]
+        self._file.write(_HEADER.pack(MAGIC, VERSION, device.idVendor, device.idProduct,
+                                      device.bcdDevice, len(serial)) + serial)
+
+    def record(self, endpoint, data, start, duration, status=STATUS_OK):
+        """Record a transfer that started at `start` (a `time.perf_counter()`)."""
+        data = bytes(data)
+        with self._lock:
+            self._file.write(_RECORD.pack(start - self._start, duration, endpoint, status,
+                                          len(data)) + data)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_capture(path):
+    """Read a capture file into (header dict, list of `Transfer`s)."""
+    with open(path, 'rb') as f:
+        buf = f.read()
+    magic, version, vid, pid, bcd, slen = _HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('{} is not a supported capture file'.format(path))
+    offset = _HEADER.size
+    header = {'idVendor': vid, 'idProduct': pid, 'bcdDevice': bcd,
+              'serial_number': buf[offset:offset + slen].decode('utf-8') or None}
+    offset += slen
+    transfers = []
+    while offset < len(buf):
+        start, duration, endpoint, status, length = _RECORD.unpack_from(buf, offset)
+        offset += _RECORD.size
+        transfers.append(Transfer(start, duration, endpoint, status,
+                                  buf[offset:offset + length]))
+        offset += length
+    return header, transfers
+
+
+def _serial_number(device):
+    try:
+        return device.serial_number
+    except (usb.core.USBError, ValueError):
+        return None
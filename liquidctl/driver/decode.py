@@ -0,0 +1,165 @@
+"""Batch decoding of raw status reports into NumPy structured arrays.
+
+For telemetry logging and analysis, many raw reports (e.g. from a capture or
+a transfer trace) can be decoded in a single call, with fixed field offsets
+and no per-field Python code.  The usual list of (key, value, unit) tuples
+remains available as a view over the decoded records.
+
+    >>> report = bytes([0x04, 30, 7, 0x03, 0xe8, 0x07, 0xd0] + [0]*4 + [4, 0, 0, 2] + [0]*49)
+    >>> records = decode_kraken_reports([report]*1000)
+    >>> records.shape, float(records['liquid_temperature'][0]), int(records['pump_speed'][0])
+    ((1000,), 30.7, 2000)
+    >>> kraken_status(records[0])
+    [('Liquid temperature', 30.7, '°C'), ('Fan speed', 1000, 'rpm'), ('Pump speed', 2000, 'rpm'), ('Firmware version', '4.0.2', '')]
+
+Requires NumPy, which is otherwise not a dependency of liquidctl.
+
+Copyright (C) 2018  Jonas Malaco
+Copyright (C) 2018  each contribution's author
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+KRAKEN_REPORT_LENGTH = 64
+SMART_DEVICE_REPORT_LENGTH = 21
+
+# views over the raw reports, at the offsets used by the drivers
+_KRAKEN_RAW = {
+    'names':   ['temp_int', 'temp_dec', 'fan', 'pump', 'fw_major', 'fw_minor', 'fw_patch'],
+    'formats': ['u1', 'u1', '>u2', '>u2', 'u1', '>u2', 'u1'],
+    'offsets': [1, 2, 3, 5, 0xb, 0xc, 0xe],
+    'itemsize': KRAKEN_REPORT_LENGTH,
+}
+_SMART_DEVICE_RAW = {
+    'names':   ['noise', 'rpm', 'volt_int', 'volt_dec', 'current', 'fw_major', 'fw_minor',
+                'fw_patch', 'channel_state', 'led_type', 'led_count'],
+    'formats': ['u1', '>u2', 'u1', 'u1', 'u1', 'u1', '>u2', 'u1', 'u1', 'u1', 'u1'],
+    'offsets': [1, 3, 7, 8, 10, 0xb, 0xc, 0xe, 15, 16, 17],
+    'itemsize': SMART_DEVICE_REPORT_LENGTH,
+}
+
+KRAKEN_DTYPE = [
+    ('liquid_temperature', 'f8'),  # °C
+    ('fan_speed', 'u2'),           # rpm
+    ('pump_speed', 'u2'),          # rpm
+    ('firmware', 'u2', (3,)),
+]
+SMART_DEVICE_DTYPE = [
+    ('channel', 'u1'),             # zero-based fan channel
+    ('fan_mode', 'u1'),            # 0: not connected, 1: DC, 2: PWM
+    ('fan_speed', 'u2'),           # rpm
+    ('fan_voltage', 'f8'),         # V
+    ('fan_current', 'f8'),         # A
+    ('noise_level', 'u1'),         # dB
+    ('firmware', 'u2', (3,)),
+    ('led_type', 'u1'),            # 0: Hue+ Strip, 1: Aer RGB
+    ('led_count', 'u1'),           # LED accessories
+]
+
+_FAN_MODES = ['—', 'DC', 'PWM']
+_LED_TYPES = [('Hue+ Strip', 10), ('Aer RGB', 8)]
+
+
+def decode_kraken_reports(reports):
+    """Decode Kraken X/M status reports into a KRAKEN_DTYPE array."""
+    raw = _raw_view(reports, _KRAKEN_RAW)
+    out = np.empty(len(raw), dtype=KRAKEN_DTYPE)
+    out['liquid_temperature'] = raw['temp_int'] + raw['temp_dec']/10
+    out['fan_speed'] = raw['fan']
+    out['pump_speed'] = raw['pump']
+    _decode_firmware(raw, out)
+    return out
+
+
+def decode_smart_device_reports(reports):
+    """Decode Smart Device/Grid+ status reports into a SMART_DEVICE_DTYPE array.
+
+    Each report refers to a single fan channel.
+    """
+    raw = _raw_view(reports, _SMART_DEVICE_RAW)
+    out = np.empty(len(raw), dtype=SMART_DEVICE_DTYPE)
+    out['channel'] = raw['channel_state'] >> 4
+    out['fan_mode'] = raw['channel_state'] & 0x3
+    out['fan_speed'] = raw['rpm']
+    out['fan_voltage'] = raw['volt_int'] + raw['volt_dec']/100
+    out['fan_current'] = raw['current']/100
+    out['noise_level'] = raw['noise']
+    out['led_type'] = raw['led_type'] >> 3
+    out['led_count'] = raw['led_count']
+    _decode_firmware(raw, out)
+    return out
+
+
+def kraken_status(record, device_type='Kraken X'):
+    """View a decoded Kraken record as (key, value, unit) tuples."""
+    firmware = '{}.{}.{}'.format(*record['firmware'])
+    if device_type == 'Kraken M':
+        return [('Firmware version', firmware, '')]
+    return [
+        ('Liquid temperature', float(record['liquid_temperature']), '°C'),
+        ('Fan speed', int(record['fan_speed']), 'rpm'),
+        ('Pump speed', int(record['pump_speed']), 'rpm'),
+        ('Firmware version', firmware, '')
+    ]
+
+
+def smart_device_status(records, has_leds=True):
+    """View decoded Smart Device records, one per channel, as (key, value, unit) tuples."""
+    status = []
+    for i, rec in enumerate(records):
+        num = int(rec['channel']) + 1
+        mode = int(rec['fan_mode'])
+        status.append(('Fan {}'.format(num), _FAN_MODES[mode], ''))
+        if mode:
+            status.append(('Fan {} speed'.format(num), int(rec['fan_speed']), 'rpm'))
+            status.append(('Fan {} voltage'.format(num), float(rec['fan_voltage']), 'V'))
+            status.append(('Fan {} current'.format(num), float(rec['fan_current']), 'A'))
+        if i != 0:
+            continue
+        status.append(('Firmware version', '{}.{}.{}'.format(*rec['firmware']), ''))
+        if has_leds:
+            lcount = int(rec['led_count'])
+            status.append(('LED accessories', lcount, ''))
+            if lcount > 0:
+                ltype, lsize = _LED_TYPES[rec['led_type']]
+                status.append(('LED accessory type', ltype, ''))
+                status.append(('LED count (total)', lcount*lsize, ''))
+    noise = records['noise_level']
+    status.append(('Noise level', round(int(noise.sum())/len(noise)), 'dB'))
+    return sorted(status)
+
+
+def _raw_view(reports, layout):
+    if np is None:
+        raise RuntimeError('batch decoding requires NumPy')
+    length = layout['itemsize']
+    if isinstance(reports, (bytes, bytearray, memoryview)):
+        buf = reports
+    else:
+        buf = b''.join(bytes(report[:length]).ljust(length, b'\0') for report in reports)
+    if len(buf) % length:
+        raise ValueError('buffer size not a multiple of the {}-byte report length'.format(length))
+    return np.frombuffer(buf, dtype=np.dtype(layout))
+
+
+def _decode_firmware(raw, out):
+    out['firmware'][:, 0] = raw['fw_major']
+    out['firmware'][:, 1] = raw['fw_minor']
+    out['firmware'][:, 2] = raw['fw_patch']
@@ -0,0 +1,167 @@
+"""Hotplug monitoring of supported devices.
+
+A `HotplugMonitor` keeps a `DeviceRegistry` up to date as devices are
+attached, detached or re-enumerated (e.g. when resuming from suspend), and
+notifies subscribers with ('add' | 'remove', driver instance) events.
+
+On Linux, with pyudev installed, kernel uevents are followed through netlink
+and only the affected device is probed.  Elsewhere the bus is polled in the
+background, and the registry is updated incrementally: instances of devices
+that remain attached, together with their connection state, are kept.
+
+Callbacks run on the monitor thread; GUIs should forward the events to their
+own thread (e.g. through a Qt signal).
+
+    >>> from liquidctl.driver.kraken_two import KrakenTwoDriver
+    >>> from liquidctl.driver.registry import DeviceRegistry
+    >>> from liquidctl.driver.simulated import *
+    >>> backend = SimulatedBackend()
+    >>> monitor = HotplugMonitor(DeviceRegistry([KrakenTwoDriver], backend=backend), use_udev=False)
+    >>> monitor.subscribe(lambda event, dev: print(event, dev.description))
+    >>> monitor.check()
+    >>> kraken = backend.add(SimulatedKrakenTwo())
+    >>> monitor.check()
+    add NZXT Kraken X (X42, X52, X62 or X72)
+    >>> backend.remove(kraken)
+    >>> monitor.check()
+    remove NZXT Kraken X (X42, X52, X62 or X72)
+
+Copyright (C) 2018  Jonas Malaco
+Copyright (C) 2018  each contribution's author
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import logging
+import sys
+import threading
+
+import usb.core
+
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+
+
+LOGGER = logging.getLogger(__name__)
+
+_POLL_INTERVAL = 1.0
+_MAX_BACKOFF = 30.0  # s, between retries of a failing scan
+
+
+class HotplugMonitor(object):
+    """Watch for supported devices being added or removed."""
+
+    def __init__(self, registry, interval=_POLL_INTERVAL, use_udev=True):
+        self.registry = registry
+        self.interval = interval
+        self._use_udev = use_udev and pyudev is not None and sys.platform.startswith('linux')
+        self._callbacks = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback):
+        """Call `callback(event, device)` on every 'add' or 'remove' event."""
+        self._callbacks.append(callback)
+
+    def unsubscribe(self, callback):
+        self._callbacks.remove(callback)
+
+    def start(self):
+        """Start monitoring in a daemon thread."""
+        if self._thread:
+            return
+        self.registry.devices()  # establish the baseline
+        self._stop.clear()
+        target = self._follow_udev if self._use_udev else self._poll
+        self._thread = threading.Thread(target=target, name='liquidctl hotplug', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def check(self):
+        """Rescan the bus once, emitting events for any changes."""
+        added, removed = self.registry.update()
+        self._emit('remove', removed)
+        self._emit('add', added)
+
+    def _poll(self):
+        delay = self.interval
+        while not self._stop.wait(delay):
+            try:
+                self.check()
+                delay = self.interval
+            except (usb.core.USBError, ConnectionError) as err:
+                # the bus, or the daemon behind a remote registry, is unavailable
+                delay = min(2*delay, max(self.interval, _MAX_BACKOFF))
+                LOGGER.warning('failed to scan for devices: %s; retrying in %.1f s', err, delay)
+
+    def _follow_udev(self):
+        monitor = None
+        missed = False
+        delay = self.interval
+        while not self._stop.is_set():
+            try:
+                if monitor is None:
+                    monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+                    monitor.filter_by('usb', device_type='usb_device')
+                    monitor.start()
+                if missed:
+                    self.check()  # catch up with the events lost after a failure
+                    missed = False
+                event = monitor.poll(timeout=self.interval)
+                if event is not None:
+                    self._handle_udev(event)
+                delay = self.interval
+            except Exception as err:
+                # udev, the bus, or the daemon behind a remote registry, is unavailable
+                monitor = None
+                missed = True
+                delay = min(2*delay, max(self.interval, _MAX_BACKOFF))
+                LOGGER.warning('failed to follow device events: %s; retrying in %.1f s', err, delay)
+                self._stop.wait(delay)
+
+    def _handle_udev(self, event):
+        try:
+            bus = int(event.properties.get('BUSNUM'))
+            address = int(event.properties.get('DEVNUM'))
+        except (TypeError, ValueError):
+            return
+        if event.action == 'add':
+            self._emit('add', self._probe(bus, address))
+        elif event.action == 'remove':
+            self._emit('remove', self.registry.remove(bus, address))
+
+    def _probe(self, bus, address):
+        backend = self.registry.backend or usb.core
+        try:
+            usbdev = backend.find(bus=bus, address=address)
+        except usb.core.USBError as err:
+            LOGGER.warning('failed to probe device on bus %i address %i: %s', bus, address, err)
+            return []
+        return self.registry.add(usbdev) if usbdev else []
+
+    def _emit(self, event, devices):
+        for dev in devices:
+            LOGGER.debug('%s: %s', event, dev.description)
+            for callback in list(self._callbacks):
+                try:
+                    callback(event, dev)
+                except Exception:
+                    LOGGER.exception('hotplug callback failed')
@@ -36,13 +36,17 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import functools
 import itertools
 import logging
+import time
 
-import usb.util
+import usb.core
 
 import liquidctl.util
 from liquidctl.driver.base_usb import BaseUsbDriver
+from liquidctl.driver.reader import is_timeout
+from liquidctl.driver.status import StatusRecord, StatusSchema
 
 
 LOGGER = logging.getLogger(__name__)
@@ -52,6 +56,7 @@ _SPEED_CHANNELS = {  # (base, minimum duty, maximum duty)
     'pump':  (0xc0, 50, 100),
 }
 _CRITICAL_TEMPERATURE = 60
+_PROFILE_TEMPERATURES = range(20, 62, 2)  # the same on both channels
 _COLOR_CHANNELS = {
     'sync':     0x0,
     'logo':     0x1,
@@ -117,6 +122,14 @@ class KrakenTwoDriver(BaseUsbDriver):
         }),
     ]
 
+    STATUS_SCHEMA = StatusSchema([
+        ('Liquid temperature', '°C'),
+        ('Fan speed', 'rpm'),
+        ('Pump speed', 'rpm'),
+        ('Firmware version', ''),
+    ])
+    LIQUID_TEMPERATURE, FAN_SPEED, PUMP_SPEED, FIRMWARE_VERSION = range(4)
+
     def __init__(self, device, description, device_type=DEVICE_KRAKENX):
         super().__init__(device, description)
         self.device_type = device_type
@@ -124,24 +137,48 @@ class KrakenTwoDriver(BaseUsbDriver):
         self.supports_cooling = self.device_type != self.DEVICE_KRAKENM
         self._supports_cooling_profiles = None  # physical storage/later inferred from fw version
 
-    def get_status(self):
+    def get_status_record(self, deadline=None):
         """Get a status report.
 
-        Returns a list of (key, value, unit) tuples.
+        Returns a `StatusRecord` following `STATUS_SCHEMA`; the Kraken M only
+        reports its firmware version, which is answered from the capability
+        cache when known.  If no report is received before `deadline` (or,
+        while the background reader runs, if it has none), an empty record
+        flagged `partial` is returned.
+
+        The record is timestamped with the time the report was received; a
+        report cached for longer than the usual reporting interval is flagged
+        `partial` as well.
         """
-        msg = self._read()
+        if self.device_type == self.DEVICE_KRAKENM:
+            firmware = self._known_capabilities().get('firmware_version')
+            if firmware:
+                return StatusRecord(self.STATUS_SCHEMA,
+                                    [None, None, None, '{}.{}.{}'.format(*firmware)])
+        try:
+            msg, timestamp, stale = self._read(deadline)
+        except TimeoutError:
+            return StatusRecord(self.STATUS_SCHEMA, partial=True)
+        except usb.core.USBError as err:
+            if deadline is None or not is_timeout(err):
+                raise
+            return StatusRecord(self.STATUS_SCHEMA, partial=True)
         firmware = '{}.{}.{}'.format(*self._firmware_version)
         if self.device_type == self.DEVICE_KRAKENM:
-            return [('Firmware version', firmware, '')]
-        else:
-            return [
-                ('Liquid temperature', msg[1] + msg[2]/10, '°C'),
-                ('Fan speed', msg[3] << 8 | msg[4], 'rpm'),
-                ('Pump speed', msg[5] << 8 | msg[6], 'rpm'),
-                ('Firmware version', firmware, '')
-            ]
-
-    def set_color(self, channel, mode, colors, speed):
+            return StatusRecord(self.STATUS_SCHEMA, [None, None, None, firmware],
+                                timestamp=timestamp)
+        return StatusRecord(self.STATUS_SCHEMA, [
+            msg[1] + msg[2]/10,
+            msg[3] << 8 | msg[4],
+            msg[5] << 8 | msg[6],
+            firmware
+        ], timestamp=timestamp, partial=stale)
+
+    @property
+    def status_schema(self):
+        return self.STATUS_SCHEMA
+
+    def set_color(self, channel, mode, colors, speed, force=False, deadline=None):
         """Set the color mode for a specific channel."""
         if not self.supports_lighting:
             raise NotImplementedError()
@@ -156,13 +193,23 @@ class KrakenTwoDriver(BaseUsbDriver):
         steps = self._generate_steps(colors, mincolors, maxcolors, mode, ringonly)
         sval = _ANIMATION_SPEEDS[speed]
         byte2 = mod2 | _COLOR_CHANNELS[channel]
+        packets = []
         for i, leds in enumerate(steps):
             seq = i << 5
             byte4 = sval | seq | mod4
             logo = [leds[0][1], leds[0][0], leds[0][2]]
             ring = list(itertools.chain(*leds[1:]))
-            self._write([0x2, 0x4c, byte2, mval, byte4] + logo + ring)
-        usb.util.dispose_resources(self.device)
+            packets.append([0x2, 0x4c, byte2, mval, byte4] + logo + ring)
+        state = tuple(map(tuple, packets))
+        if self._unchanged(('color', channel), state, force, writes=len(packets)):
+            return
+        # sync overrides both logo and ring, and each of them breaks sync
+        for other in (['logo', 'ring'] if channel == 'sync' else ['sync']):
+            self._shadow.pop(('color', other), None)
+        for packet in packets:
+            self._write(packet, deadline)
+        self._release()
+        self._applied(('color', channel), state)
 
     def _generate_steps(self, colors, mincolors, maxcolors, mode, ringonly):
         colors = list(colors)
@@ -188,36 +235,42 @@ class KrakenTwoDriver(BaseUsbDriver):
             steps = [colors]
         return steps
 
-    def set_speed_profile(self, channel, profile):
+    def set_speed_profile(self, channel, profile, force=False, deadline=None):
         """Set channel to use a speed profile."""
         if not self.supports_cooling_profiles:
             raise NotImplementedError()
         cbase, dmin, dmax = _SPEED_CHANNELS[channel]
-        # ideally we could just call normalize_profile (optionally followed by autofill_profile),
-        # but Kraken devices currently require the same set of temperatures on both channels
-        stdtemps = range(20, 62, 2)
-        tmp = liquidctl.util.normalize_profile(profile, _CRITICAL_TEMPERATURE)
-        norm = [(t, liquidctl.util.interpolate_profile(tmp, t)) for t in stdtemps]
-        for i, (temp, duty) in enumerate(norm):
-            if duty < dmin:
-                duty = dmin
-            elif duty > dmax:
-                duty = dmax
+        table = _profile_table(tuple(map(tuple, profile)), dmin, dmax)
+        key = ('speed', channel)
+        last = self._shadow.get(key, (None, None)) if not (force or self.dry_run) else (None, None)
+        if self._unchanged(key, ('profile', table), force, writes=len(table)):
+            return
+        # points are stored independently: only upload the ones that changed
+        previous = last[1] if last[0] == 'profile' else [None]*len(table)
+        for i, ((temp, duty), old) in enumerate(zip(table, previous)):
+            if (temp, duty) == old:
+                continue
             LOGGER.info('setting %s PWM duty to %i%% for liquid temperature >= %i°C',
                          channel, duty, temp)
-            self._write([0x2, 0x4d, cbase + i, temp, duty])
-        usb.util.dispose_resources(self.device)
-
-    def set_fixed_speed(self, channel, speed):
+            self._write([0x2, 0x4d, cbase + i, temp, duty], deadline)
+        saved = sum(1 for new, old in zip(table, previous) if new == old)
+        if saved:
+            LOGGER.debug('skipping %i unchanged points of %s profile', saved, channel)
+            self.writes_saved += saved
+        self._release()
+        self._applied(key, ('profile', table))
+
+    def set_fixed_speed(self, channel, speed, force=False, deadline=None):
         """Set channel to a fixed speed."""
         if not self.supports_cooling:
             raise NotImplementedError()
         elif self.supports_cooling_profiles:
-            self.set_speed_profile(channel, [(0, speed), (59, speed), (60, 100), (100, 100)])
+            self.set_speed_profile(channel, [(0, speed), (59, speed), (60, 100), (100, 100)],
+                                   force=force, deadline=deadline)
         else:
-            self.set_instantaneous_speed(channel, speed)
+            self.set_instantaneous_speed(channel, speed, force=force, deadline=deadline)
 
-    def set_instantaneous_speed(self, channel, speed):
+    def set_instantaneous_speed(self, channel, speed, force=False, deadline=None):
         """Set channel to speed, but do not ensure persistence."""
         if not self.supports_cooling:
             raise NotImplementedError()
@@ -226,41 +279,61 @@ class KrakenTwoDriver(BaseUsbDriver):
             speed = smin
         elif speed > smax:
             speed = smax
+        if self._unchanged(('speed', channel), ('fixed', speed), force):
+            return
         LOGGER.info('setting %s PWM duty to %i%%', channel, speed)
-        self._write([0x2, 0x4d, cbase & 0x70, 0, speed])
-        usb.util.dispose_resources(self.device)
+        self._write([0x2, 0x4d, cbase & 0x70, 0, speed], deadline)
+        self._release()
+        self._applied(('speed', channel), ('fixed', speed))
 
     @property
     def supports_cooling_profiles(self):
         if self._supports_cooling_profiles is None:
             if self.supports_cooling:
-                self._read()
-                self._supports_cooling_profiles = self._firmware_version >= (3, 0, 0)
+                cached = self._known_capabilities().get('supports_cooling_profiles')
+                if cached is None:
+                    self._read()
+                    cached = self._firmware_version >= (3, 0, 0)
+                    self._learn(supports_cooling_profiles=cached)
+                self._supports_cooling_profiles = cached
             else:
                 self._supports_cooling_profiles = False
         return self._supports_cooling_profiles
 
-    def _read(self):
-        msg = self.device.read(_READ_ENDPOINT, _READ_LENGTH, _READ_TIMEOUT)
-        usb.util.dispose_resources(self.device)
-        LOGGER.debug('received %s', ' '.join(format(i, '02x') for i in msg))
+    def _read(self, deadline=None):
+        """Read a status report, returning (report, timestamp, stale).
+
+        While a background reader is running, the endpoint is left to it: if
+        it has not received any report in time, TimeoutError is raised.
+        """
+        if self._reader:
+            msgs, timestamp, stale = self._latest_reports(1, deadline)
+            if not msgs:
+                raise TimeoutError('no report received by the background reader')
+            msg, = msgs
+        else:
+            timeout = self._transfer_timeout(_READ_ENDPOINT, _READ_TIMEOUT, deadline,
+                                             adaptive=False)
+            msg, timestamp, stale = self._read_report(timeout), time.time(), False
+            self._release()
         self._firmware_version = (msg[0xb], msg[0xc] << 8 | msg[0xd], msg[0xe])
-        return msg
+        self._learn(firmware_version=self._firmware_version)
+        return msg, timestamp, stale
 
-    def _write(self, data):
-        padding = [0x0]*(_WRITE_LENGTH - len(data))
-        LOGGER.debug('write %s (and %i padding bytes)',
-                     ' '.join(format(i, '02x') for i in data), len(padding))
-        if self.dry_run:
-            return
-        self.device.write(_WRITE_ENDPOINT, data + padding, _WRITE_TIMEOUT)
+    def _read_report(self, timeout=_READ_TIMEOUT):
+        return self._usb_read(_READ_ENDPOINT, _READ_LENGTH, timeout)
+
+    def _write(self, data, deadline=None):
+        timeout = self._transfer_timeout(_WRITE_ENDPOINT, _WRITE_TIMEOUT, deadline)
+        self._usb_write(_WRITE_ENDPOINT, data, _WRITE_LENGTH, timeout)
 
     def initialize(self):
         """NOOP.
 
-        Deprecated behavior: connect to the Kraken.
+        Deprecated behavior: connect to the Kraken, unless already in a session.
         """
-        self.connect()
+        if not self.in_session:
+            self.connect()
 
     def finalize(self):
         """Deprecated."""
@@ -273,4 +346,19 @@ class KrakenTwoDriver(BaseUsbDriver):
         return _COLOR_CHANNELS
 
     def get_animation_speeds(self):
-        return _ANIMATION_SPEEDS
\ No newline at end of file
+        return _ANIMATION_SPEEDS
+
+    def get_speed_channels(self):
+        return _SPEED_CHANNELS if self.supports_cooling else {}
+
+
+@functools.lru_cache(maxsize=32)
+def _profile_table(profile, dmin, dmax):
+    """Compute the (temperature, duty) table to upload for a (hashable) profile.
+
+    Ideally we could just call normalize_profile (optionally followed by
+    autofill_profile), but Kraken devices currently require the same set of
+    temperatures on both channels.
+    """
+    norm = liquidctl.util.CompiledProfile(profile, critx=_CRITICAL_TEMPERATURE)
+    return tuple((temp, min(max(norm(temp), dmin), dmax)) for temp in _PROFILE_TEMPERATURES)
@@ -0,0 +1,111 @@
+"""Adaptive transfer timeouts.
+
+A `LatencyTracker` keeps the latencies of the most recent successful transfers
+on an endpoint, and derives timeouts from them: a high percentile, scaled and
+with some margin, instead of a fixed worst case.  Until enough transfers have
+been observed, and never exceeding it, the default timeout is used.
+
+A timeout means the latencies learned no longer hold, for instance because
+the device became slower; they are then discarded, and the default timeout is
+used again until enough new transfers have been observed.
+
+    >>> tracker = LatencyTracker(min_samples=4)
+    >>> tracker.timeout(2000)
+    2000
+    >>> for seconds in [0.010, 0.012, 0.011, 0.250]:
+    ...     tracker.record(seconds)
+    >>> tracker.timeout(2000)
+    1050
+    >>> tracker.timeout(500)
+    500
+    >>> tracker = LatencyTracker(min_samples=4)
+    >>> for seconds in [0.010]*4:
+    ...     tracker.record(seconds)
+    >>> tracker.timeout(2000)
+    100
+    >>> tracker.timed_out()  # the device slowed down
+    >>> tracker.timeout(2000)
+    2000
+    >>> for seconds in [0.300]*4:
+    ...     tracker.record(seconds)
+    >>> tracker.timeout(2000)
+    1250
+
+Copyright (C) 2018  Jonas Malaco
+Copyright (C) 2018  each contribution's author
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import collections
+import threading
+import time
+
+
+class LatencyTracker(object):
+    """Latencies of the last `window` transfers, and timeouts derived from them.
+
+    Timeouts are `factor` times the `percentile` latency plus `margin` ms, but
+    no shorter than `floor` ms.
+    """
+
+    def __init__(self, window=64, percentile=0.95, factor=4.0, margin=50, floor=100,
+                 min_samples=8):
+        self.percentile = percentile
+        self.factor = factor
+        self.margin = margin
+        self.floor = floor
+        self.min_samples = min_samples
+        self._samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def record(self, seconds):
+        """Record the latency of a successful transfer."""
+        with self._lock:
+            self._samples.append(seconds)
+
+    def timed_out(self):
+        """Record a transfer that timed out, discarding the latencies learned."""
+        with self._lock:
+            self._samples.clear()
+
+    def latency(self):
+        """The `percentile` latency, in seconds, or None if not enough samples."""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[round(self.percentile*(len(ordered) - 1))]
+
+    def timeout(self, default):
+        """Timeout in milliseconds, adapted from the latencies observed."""
+        latency = self.latency()
+        if latency is None:
+            return default
+        adapted = max(self.floor, round(latency*1000*self.factor + self.margin))
+        return min(default, adapted)
+
+
+def remaining(deadline):
+    """Milliseconds left until `deadline`, a `time.monotonic()` value.
+
+    Raises `TimeoutError` if the deadline has already passed.
+    """
+    left = int((deadline - time.monotonic())*1000)
+    if left <= 0:
+        raise TimeoutError('deadline exceeded')
+    return left
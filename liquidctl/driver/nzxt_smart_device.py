@@ -75,10 +75,13 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import itertools
 import logging
+import time
 
-import usb.util
+import usb.core
 
 from liquidctl.driver.base_usb import BaseUsbDriver
+from liquidctl.driver.reader import is_timeout
+from liquidctl.driver.status import StatusRecord, StatusSchema
 
 
 LOGGER = logging.getLogger(__name__)
@@ -149,51 +152,82 @@ class NzxtSmartDeviceDriver(BaseUsbDriver):
         self._speed_channels = {'fan{}'.format(i + 1): (i, _MIN_DUTY, _MAX_DUTY)
                                 for i in range(speed_channel_count)}
         self._color_channels = {'sync': (0)} if color_channel_count else {}
-
-    def initialize(self):
+        metrics = [('Firmware version', ''), ('Noise level', 'dB')]
+        for i in range(speed_channel_count):
+            metrics += [('Fan {}'.format(i + 1), ''),
+                        ('Fan {} speed'.format(i + 1), 'rpm'),
+                        ('Fan {} voltage'.format(i + 1), 'V'),
+                        ('Fan {} current'.format(i + 1), 'A')]
+        if color_channel_count:
+            metrics += [('LED accessories', ''), ('LED accessory type', ''),
+                        ('LED count (total)', '')]
+        # sorted by key, like the reports in previous versions
+        self._status_schema = StatusSchema(sorted(metrics))
+
+    def initialize(self, deadline=None):
         """Initialize the device.
 
         Detects all connected fans and LED accessories, and allows subsequent
         calls to get_status.
         """
-        self._write([0x1, 0x5c])  # initialize/detect connected devices and their type
-        self._write([0x1, 0x5d])  # start reporting
-        usb.util.dispose_resources(self.device)
+        self._write([0x1, 0x5c], deadline)  # initialize/detect connected devices and their type
+        self._write([0x1, 0x5d], deadline)  # start reporting
+        self._release()
+        self.forget_state()
 
-    def get_status(self):
+    def get_status_record(self, deadline=None):
         """Get a status report.
 
-        Returns a list of (key, value, unit) tuples.
+        Returns a `StatusRecord` following `status_schema`.  Each channel is
+        reported separately; channels whose reports do not arrive within the
+        usual latency, or before `deadline`, are omitted and the record is
+        flagged `partial`.
+
+        The record is timestamped with the time the oldest report was
+        received; reports cached for longer than the usual reporting interval
+        also flag the record `partial`.
         """
-        status = []
+        count = len(self._speed_channels)
+        if self._reader:
+            # the endpoint is left to the reader, even if it has nothing yet
+            msgs, timestamp, stale = self._latest_reports(count, deadline)
+        else:
+            timestamp, stale = time.time(), False
+            msgs = self._read_reports(count, deadline)
+            self._release()
+        status = StatusRecord(self._status_schema, timestamp=timestamp,
+                              partial=len(msgs) < count or stale)
+        if not msgs:
+            return status
         noise = []
-        for i, _ in enumerate(self._speed_channels):
-            msg = self.device.read(_READ_ENDPOINT, _READ_LENGTH, _READ_TIMEOUT)
-            LOGGER.debug('received %s', ' '.join(format(i, '02x') for i in msg))
+        for i, msg in enumerate(msgs):
             num = (msg[15] >> 4) + 1
             state = msg[15] & 0x3
-            status.append(('Fan {}'.format(num), ['—', 'DC', 'PWM'][state], ''))
+            status['Fan {}'.format(num)] = ['—', 'DC', 'PWM'][state]
             noise.append(msg[1])
             if state:
-                status.append(('Fan {} speed'.format(num), msg[3] << 8 | msg[4], 'rpm'))
-                status.append(('Fan {} voltage'.format(num), msg[7] + msg[8]/100, 'V'))
-                status.append(('Fan {} current'.format(num), msg[10]/100, 'A'))
+                status['Fan {} speed'.format(num)] = msg[3] << 8 | msg[4]
+                status['Fan {} voltage'.format(num)] = msg[7] + msg[8]/100
+                status['Fan {} current'.format(num)] = msg[10]/100
             if i != 0:
                 continue
             fw = '{}.{}.{}'.format(msg[0xb], msg[0xc] << 8 | msg[0xd], msg[0xe])
-            status.append(('Firmware version', fw, ''))
+            status['Firmware version'] = fw
             if self._color_channels:
                 lcount = msg[0x11]
-                status.append(('LED accessories', lcount, ''))
+                status['LED accessories'] = lcount
                 if lcount > 0:
                     ltype, lsize = [('Hue+ Strip', 10), ('Aer RGB', 8)][msg[0x10] >> 3]
-                    status.append(('LED accessory type', ltype, ''))
-                    status.append(('LED count (total)', lcount*lsize, ''))
-        status.append(('Noise level', round(sum(noise)/len(noise)), 'dB'))
-        usb.util.dispose_resources(self.device)
-        return sorted(status)
+                    status['LED accessory type'] = ltype
+                    status['LED count (total)'] = lcount*lsize
+        status['Noise level'] = round(sum(noise)/len(noise))
+        return status
+
+    @property
+    def status_schema(self):
+        return self._status_schema
 
-    def set_color(self, channel, mode, colors, speed):
+    def set_color(self, channel, mode, colors, speed, force=False, deadline=None):
         """Set the color mode.
 
         Only available for the Smart Device.
@@ -221,37 +255,70 @@ class NzxtSmartDeviceDriver(BaseUsbDriver):
         else:
             steps = [color*40 for color in colors]
         sval = _ANIMATION_SPEEDS[speed]
+        packets = []
         for i, leds in enumerate(steps):
             seq = i << 5
             byte4 = sval | seq | mod4
-            self._write([0x2, 0x4b, mval, mod3, byte4] + leds[0:57])
-            self._write([0x3] + leds[57:])
-        usb.util.dispose_resources(self.device)
+            packets.append([0x2, 0x4b, mval, mod3, byte4] + leds[0:57])
+            packets.append([0x3] + leds[57:])
+        state = tuple(map(tuple, packets))
+        if self._unchanged(('color', channel), state, force, writes=len(packets)):
+            return
+        for packet in packets:
+            self._write(packet, deadline)
+        self._release()
+        self._applied(('color', channel), state)
 
-    def set_fixed_speed(self, channel, speed):
+    def set_fixed_speed(self, channel, speed, force=False, deadline=None):
         """Set channel to a fixed speed."""
         cid, smin, smax = self._speed_channels[channel]
         if speed < smin:
             speed = smin
         elif speed > smax:
             speed = smax
-        LOGGER.info('setting %s duty to %i%%', channel, speed)
-        self._write([0x2, 0x4d, cid, 0, speed])
-        usb.util.dispose_resources(self.device)
-
-    def _write(self, data):
-        padding = [0x0]*(_WRITE_LENGTH - len(data))
-        LOGGER.debug('write %s (and %i padding bytes)',
-                     ' '.join(format(i, '02x') for i in data), len(padding))
-        if self.dry_run:
+        if self._unchanged(('speed', channel), ('fixed', speed), force):
             return
-        self.device.write(_WRITE_ENDPOINT, data + padding, _WRITE_TIMEOUT)
+        LOGGER.info('setting %s duty to %i%%', channel, speed)
+        self._write([0x2, 0x4d, cid, 0, speed], deadline)
+        self._release()
+        self._applied(('speed', channel), ('fixed', speed))
+
+    def _read_reports(self, count, deadline):
+        msgs = []
+        for i in range(count):
+            try:
+                # the first report may take a full reporting interval; after
+                # that, a report arriving late is not worth waiting for
+                timeout = self._transfer_timeout(_READ_ENDPOINT, _READ_TIMEOUT, deadline,
+                                                 adaptive=bool(msgs))
+                msgs.append(self._read_report(timeout))
+            except TimeoutError:
+                break
+            except usb.core.USBError as err:
+                if not is_timeout(err) or (not msgs and deadline is None):
+                    raise
+                LOGGER.debug('status report timed out after %i of %i channels', len(msgs), count)
+                break
+        return msgs
+
+    def _read_report(self, timeout=_READ_TIMEOUT):
+        return self._usb_read(_READ_ENDPOINT, _READ_LENGTH, timeout)
+
+    def _report_channel(self, msg):
+        return msg[15] >> 4
+
+    def _write(self, data, deadline=None):
+        timeout = self._transfer_timeout(_WRITE_ENDPOINT, _WRITE_TIMEOUT, deadline)
+        self._usb_write(_WRITE_ENDPOINT, data, _WRITE_LENGTH, timeout)
 
     def get_color_modes(self):
         return _COLOR_MODES
         
     def get_color_channels(self):
-        return _COLOR_CHANNELS
+        return self._color_channels
 
     def get_animation_speeds(self):
-        return _ANIMATION_SPEEDS
\ No newline at end of file
+        return _ANIMATION_SPEEDS
+
+    def get_speed_channels(self):
+        return self._speed_channels
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""Background reading of status reports.
+
+Devices that continuously report their status on an interrupt endpoint can
+have it drained by a `BackgroundReader`.  The latest report of each channel is
+kept in memory, together with the time it was received, allowing status to be
+queried without waiting for USB transfers.  Reports are timestamped, so that a
+device that stopped reporting can be told apart from a healthy one.
+
+Copyright (C) 2018  Jonas Malaco
+Copyright (C) 2018  each contribution's author
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import errno
+import logging
+import threading
+import time
+
+import usb.core
+
+
+LOGGER = logging.getLogger(__name__)
+
+_POLL_TIMEOUT = 500  # ms; bounds how long stop() may take
+_ERROR_BACKOFF = 1.0
+
+
+def is_timeout(err):
+    """Whether a `usb.core.USBError` was caused by a timeout."""
+    return isinstance(err, getattr(usb.core, 'USBTimeoutError', ())) or \
+        getattr(err, 'errno', None) == errno.ETIMEDOUT
+
+
+class BackgroundReader(object):
+    """Drain status reports in a daemon thread, caching the latest per channel.
+
+    `read(timeout)` should return one raw report, and `channel_of(report)` the
+    channel it refers to.
+    """
+
+    def __init__(self, read, channel_of, name=None):
+        self._read = read
+        self._channel_of = channel_of
+        self._reports = {}  # channel -> (report, monotonic time, wall clock time)
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Stop the reader, waiting for any pending read to finish."""
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def latest(self, count=1, timeout=None):
+        """Get the latest reports, ordered by channel, as (report, timestamp) pairs.
+
+        Timestamps are the `time.time()` each report was received.  Waits up
+        to `timeout` seconds until reports for at least `count` channels have
+        been received, returning what is available by then.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._reports) >= count, timeout)
+            return [(self._reports[c][0], self._reports[c][2]) for c in sorted(self._reports)]
+
+    def age(self):
+        """Seconds elapsed since the oldest cached report was received."""
+        with self._cond:
+            if not self._reports:
+                return None
+            return time.monotonic() - min(t for _, t, _ in self._reports.values())
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                msg = self._read(_POLL_TIMEOUT)
+            except usb.core.USBError as err:
+                if not is_timeout(err):
+                    LOGGER.warning('background read failed: %s', err)
+                    self._stop.wait(_ERROR_BACKOFF)
+                continue
+            with self._cond:
+                self._reports[self._channel_of(msg)] = (msg, time.monotonic(), time.time())
+                self._cond.notify_all()
@@ -0,0 +1,176 @@
+"""Device enumeration shared by all drivers.
+
+Instead of having each driver search the bus once for every entry in its
+SUPPORTED_DEVICES, a `DeviceRegistry` scans the bus a single time, indexes
+the devices found by (vendor id, product id), and dispatches them to the
+drivers from that index.  Results are cached until `refresh()` or
+`invalidate()` are called, and can be incrementally updated on hotplug events
+(see `liquidctl.driver.hotplug`).
+
+Drivers can also be given as 'module:Class' strings, in which case they,
+together with pyusb, are only imported once devices are first needed.
+
+    >>> from liquidctl.driver.kraken_two import KrakenTwoDriver
+    >>> from liquidctl.driver.nzxt_smart_device import NzxtSmartDeviceDriver
+    >>> from liquidctl.driver.simulated import *
+    >>> backend = SimulatedBackend([SimulatedSmartDevice(), SimulatedKrakenTwo()])
+    >>> registry = DeviceRegistry([KrakenTwoDriver, NzxtSmartDeviceDriver], backend=backend)
+    >>> [dev.description for dev in registry.devices()]
+    ['NZXT Kraken X (X42, X52, X62 or X72)', 'NZXT Smart Device']
+    >>> registry.devices() is registry.devices()
+    False
+    >>> registry.devices()[0] is registry.devices()[0]
+    True
+    >>> kraken = registry.devices()[0]
+    >>> smart = backend.devices[0]
+    >>> backend.remove(smart)
+    >>> grid = backend.add(SimulatedSmartDevice(color_channel_count=0))
+    >>> added, removed = registry.update()
+    >>> [dev.description for dev in added], [dev.description for dev in removed]
+    (['NZXT Grid+ V3 (experimental)'], ['NZXT Smart Device'])
+    >>> registry.devices()[0] is kraken
+    True
+    >>> DeviceRegistry(['liquidctl.driver.kraken_two:KrakenTwoDriver']).drivers
+    [<class 'liquidctl.driver.kraken_two.KrakenTwoDriver'>]
+
+Copyright (C) 2018  Jonas Malaco
+Copyright (C) 2018  each contribution's author
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import importlib
+import logging
+import threading
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class DeviceRegistry(object):
+    """Enumerate devices supported by `drivers` in a single bus scan.
+
+    Devices are searched with `usb.core`, unless some other `backend` with a
+    compatible `find` function is passed.
+    """
+
+    def __init__(self, drivers, backend=None):
+        self._drivers = list(drivers)
+        self.backend = backend
+        self._devices = None
+        self._lock = threading.RLock()
+
+    @property
+    def drivers(self):
+        """The driver classes, loading any given as 'module:Class' strings."""
+        with self._lock:
+            self._drivers = [load_driver(drv) for drv in self._drivers]
+            return list(self._drivers)
+
+    def scan(self):
+        """Scan the bus once and index the devices by (vid, pid)."""
+        if self.backend:
+            backend = self.backend
+        else:
+            import usb.core
+            backend = usb.core
+        index = {}
+        for usbdev in backend.find(find_all=True):
+            key = (usbdev.idVendor, usbdev.idProduct)
+            index.setdefault(key, []).append(usbdev)
+        LOGGER.debug('found %i USB devices', sum(len(devs) for devs in index.values()))
+        return index
+
+    def dispatch(self, index):
+        """Instantiate drivers for the devices in an index."""
+        found = []
+        for driver in self.drivers:
+            for vid, pid, ver, description, kwargs in driver.SUPPORTED_DEVICES:
+                for dev in index.get((vid, pid), []):
+                    if ver and (dev.bcdDevice < ver[0] or dev.bcdDevice > ver[1]):
+                        continue
+                    found.append(driver(dev, description, **kwargs))
+        return found
+
+    def probe(self, usbdev):
+        """Instantiate drivers for a single device."""
+        return self.dispatch({(usbdev.idVendor, usbdev.idProduct): [usbdev]})
+
+    def add(self, usbdev):
+        """Register a newly attached device; returns the new driver instances."""
+        with self._lock:
+            current = self.devices()
+            if any(_location(dev.device) == _location(usbdev) for dev in current):
+                return []
+            added = self.probe(usbdev)
+            self._devices = current + added
+            return added
+
+    def remove(self, bus, address):
+        """Unregister a detached device; returns the removed driver instances."""
+        with self._lock:
+            current = self.devices()
+            removed = [dev for dev in current if _location(dev.device) == (bus, address)]
+            self._devices = [dev for dev in current if dev not in removed]
+            return removed
+
+    def update(self):
+        """Rescan the bus, keeping the instances of devices still present.
+
+        Drivers are only instantiated for devices at new bus locations.
+        Returns lists of added and removed driver instances.
+        """
+        with self._lock:
+            current = self.devices()
+            known = {_location(dev.device) for dev in current}
+            index = self.scan()
+            present = {_location(usbdev) for usbdevs in index.values() for usbdev in usbdevs}
+            unseen = {}
+            for key, usbdevs in index.items():
+                usbdevs = [usbdev for usbdev in usbdevs if _location(usbdev) not in known]
+                if usbdevs:
+                    unseen[key] = usbdevs
+            removed = [dev for dev in current if _location(dev.device) not in present]
+            added = self.dispatch(unseen)
+            self._devices = [dev for dev in current if dev not in removed] + added
+            return added, removed
+
+    def devices(self):
+        """Get driver instances for all supported devices, scanning if necessary."""
+        with self._lock:
+            if self._devices is None:
+                self._devices = self.dispatch(self.scan())
+            return list(self._devices)
+
+    def refresh(self):
+        """Rescan the bus, discarding any cached results."""
+        self.invalidate()
+        return self.devices()
+
+    def invalidate(self):
+        """Discard cached results; the next call to `devices()` will rescan."""
+        with self._lock:
+            self._devices = None
+
+
+def load_driver(spec):
+    """Load a driver class from a 'module:Class' string; classes are returned as is."""
+    if not isinstance(spec, str):
+        return spec
+    module, _, name = spec.partition(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def _location(usbdev):
+    return (usbdev.bus, usbdev.address)
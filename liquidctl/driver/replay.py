@@ -0,0 +1,111 @@
+"""Replay of USB transfer captures.
+
+A `ReplayBackend` feeds captures made with `liquidctl.driver.capture` back
+through the drivers, without the hardware that produced them, at the original
+speed or accelerated:
+
+    backend = ReplayBackend(['kraken.lqcap'], speed=10)
+    dev, = KrakenTwoDriver.find_supported_devices(backend=backend)
+
+Copyright (C) 2018  Jonas Malaco
+Copyright (C) 2018  each contribution's author
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import array
+import collections
+import errno
+import logging
+import time
+
+import usb.core
+
+from liquidctl.driver.capture import STATUS_ERROR, STATUS_TIMEOUT, read_capture
+from liquidctl.driver.simulated import SimulatedBackend, SimulatedUsbDevice
+
+
+LOGGER = logging.getLogger(__name__)
+
+_USB_TIMEOUT_ERROR = getattr(usb.core, 'USBTimeoutError', usb.core.USBError)
+
+
+class ReplayDevice(SimulatedUsbDevice):
+    """Device that replays the transfers in a capture file.
+
+    Reads return the captured reports in order.  Transfers complete no sooner
+    than they did in the capture, scaled by `speed`; `speed=None` replays as
+    fast as possible.  Writes that differ from the ones captured are logged.
+    """
+
+    def __init__(self, path, speed=1.0, **kwargs):
+        header, transfers = read_capture(path)
+        kwargs.setdefault('serial_number', header['serial_number'])
+        super().__init__(header['idVendor'], header['idProduct'],
+                         bcdDevice=header['bcdDevice'], **kwargs)
+        self.path = path
+        self.speed = speed
+        self.mismatches = 0
+        self._reads = collections.deque(t for t in transfers if t.endpoint & 0x80)
+        self._writes = collections.deque(t for t in transfers if not t.endpoint & 0x80)
+        self._replay_start = None
+
+    def write(self, endpoint, data, timeout=None):
+        self._transfer(timeout)
+        packet = bytes(data)
+        with self._lock:
+            captured = self._writes.popleft() if self._writes else None
+            self.stats['writes'] += 1
+        if captured is None:
+            LOGGER.warning('%s: write past the end of the capture', self.path)
+            return len(packet)
+        if captured.data != packet:
+            self.mismatches += 1
+            LOGGER.warning('%s: write differs from the capture at t=%.3f s',
+                           self.path, captured.time)
+        self._replay(captured)
+        return len(packet)
+
+    def read(self, endpoint, size, timeout=None):
+        self._transfer(timeout)
+        with self._lock:
+            captured = self._reads.popleft() if self._reads else None
+        if captured is None:
+            if timeout:
+                time.sleep(timeout/1000)
+            raise _USB_TIMEOUT_ERROR('Operation timed out', errno=errno.ETIMEDOUT)
+        self._replay(captured)
+        self.stats['reads'] += 1
+        return array.array('B', captured.data[:size])
+
+    def _replay(self, captured):
+        now = time.perf_counter()
+        if self._replay_start is None:
+            self._replay_start = now - captured.time/self.speed if self.speed else now
+        if self.speed:
+            end = max(now + captured.duration/self.speed,
+                      self._replay_start + (captured.time + captured.duration)/self.speed)
+            time.sleep(max(0, end - now))
+        if captured.status == STATUS_TIMEOUT:
+            self.stats['timeouts'] += 1
+            raise _USB_TIMEOUT_ERROR('Operation timed out', errno=errno.ETIMEDOUT)
+        elif captured.status == STATUS_ERROR:
+            raise usb.core.USBError('Captured transfer error', errno=errno.EIO)
+
+
+class ReplayBackend(SimulatedBackend):
+    """Stand-in for `usb.core` that finds devices replaying capture files."""
+
+    def __init__(self, paths, speed=1.0):
+        super().__init__(ReplayDevice(path, speed=speed) for path in paths)
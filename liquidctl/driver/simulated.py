@@ -0,0 +1,305 @@
+"""Simulated USB backend for benchmarks and tests without hardware.
+
+The simulated devices mimic the subset of `usb.core.Device` used by the
+drivers, and speak the same protocols as the real hardware: they accept the
+65-byte packets built by `KrakenTwoDriver` and `NzxtSmartDeviceDriver`, keep
+the resulting lighting and speed state, and produce status reports in the
+formats the drivers decode.
+
+Transfers can be made slower and less reliable with the `latency`, `jitter`
+and `timeout_rate` parameters, allowing throughput and scaling work to be
+measured on any machine.
+
+    >>> backend = SimulatedBackend([SimulatedKrakenTwo(), SimulatedSmartDevice()])
+    >>> len(backend.find(idVendor=0x1e71, find_all=True))
+    2
+    >>> from liquidctl.driver.kraken_two import KrakenTwoDriver
+    >>> [dev.description for dev in KrakenTwoDriver.find_supported_devices(backend=backend)]
+    ['NZXT Kraken X (X42, X52, X62 or X72)']
+
+
+Copyright (C) 2018  Jonas Malaco
+Copyright (C) 2018  each contribution's author
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import array
+import errno
+import itertools
+import logging
+import random
+import threading
+import time
+
+import usb.core
+
+
+LOGGER = logging.getLogger(__name__)
+
+_USB_TIMEOUT_ERROR = getattr(usb.core, 'USBTimeoutError', usb.core.USBError)
+_ADDRESSES = itertools.count(2)
+
+
+class SimulatedUsbDevice(object):
+    """Base class for simulated USB devices.
+
+    Subclasses implement `_handle_write(packet)` and `_next_report()`.
+    """
+
+    def __init__(self, idVendor, idProduct, bcdDevice=0x100, serial_number=None,
+                 bus=1, address=None, port_number=None, latency=0.0, jitter=0.0,
+                 timeout_rate=0.0, seed=None):
+        self.idVendor = idVendor
+        self.idProduct = idProduct
+        self.bcdDevice = bcdDevice
+        self.bus = bus
+        self.address = address or next(_ADDRESSES)
+        self.port_number = port_number or self.address
+        self.serial_number = serial_number or '{:08X}'.format(self.address)
+        self.latency = latency
+        self.jitter = jitter
+        self.timeout_rate = timeout_rate
+        self.stats = {'writes': 0, 'reads': 0, 'timeouts': 0, 'claims': 0, 'releases': 0}
+        self._claimed = False
+        self._configuration = None
+        self._kernel_driver_active = False
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._ctx = self  # for usb.util.dispose_resources
+
+    def __repr__(self):
+        return '<{} {:04x}:{:04x} on bus {} address {}>'.format(
+            type(self).__name__, self.idVendor, self.idProduct, self.bus, self.address)
+
+    def write(self, endpoint, data, timeout=None):
+        """Write a packet; mimics `usb.core.Device.write`."""
+        self._transfer(timeout)
+        packet = bytes(data)
+        with self._lock:
+            self.stats['writes'] += 1
+            self._handle_write(packet)
+        return len(packet)
+
+    def read(self, endpoint, size, timeout=None):
+        """Read a report; mimics `usb.core.Device.read`."""
+        self._transfer(timeout)
+        with self._lock:
+            report = self._next_report()
+            if report is None:
+                self.stats['timeouts'] += 1
+        if report is None:
+            if timeout:
+                time.sleep(timeout/1000)
+            raise _USB_TIMEOUT_ERROR('Operation timed out', errno=errno.ETIMEDOUT)
+        self.stats['reads'] += 1
+        return array.array('B', report[:size])
+
+    def is_kernel_driver_active(self, interface):
+        return self._kernel_driver_active
+
+    def detach_kernel_driver(self, interface):
+        self._kernel_driver_active = False
+
+    def attach_kernel_driver(self, interface):
+        self._kernel_driver_active = True
+
+    def get_active_configuration(self):
+        return self._configuration
+
+    def set_configuration(self, configuration=1):
+        self._configuration = configuration
+
+    def dispose(self, device):
+        """Release the interface; called by `usb.util.dispose_resources`."""
+        if self._claimed:
+            self._claimed = False
+            self.stats['releases'] += 1
+
+    def _transfer(self, timeout):
+        if not self._claimed:
+            self._claimed = True
+            self.stats['claims'] += 1
+        delay = max(0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+        if self.timeout_rate and self._random.random() < self.timeout_rate:
+            self.stats['timeouts'] += 1
+            time.sleep(timeout/1000 if timeout else delay)
+            raise _USB_TIMEOUT_ERROR('Operation timed out', errno=errno.ETIMEDOUT)
+        if timeout and delay > timeout/1000:
+            self.stats['timeouts'] += 1
+            time.sleep(timeout/1000)
+            raise _USB_TIMEOUT_ERROR('Operation timed out', errno=errno.ETIMEDOUT)
+        if delay:
+            time.sleep(delay)
+
+    def _handle_write(self, packet):
+        raise NotImplementedError()
+
+    def _next_report(self):
+        raise NotImplementedError()
+
+
+class SimulatedKrakenTwo(SimulatedUsbDevice):
+    """Simulated third generation NZXT Kraken X or M."""
+
+    def __init__(self, device_type='Kraken X', firmware=(4, 0, 2), liquid_temperature=30.0,
+                 **kwargs):
+        pid = 0x1715 if device_type == 'Kraken M' else 0x170e
+        super().__init__(0x1e71, pid, **kwargs)
+        self.device_type = device_type
+        self.firmware = firmware
+        self.liquid_temperature = liquid_temperature
+        self.lighting = {}  # channel -> {'mode', 'speed', 'steps': {seq: leds}}
+        self.speed = {
+            'fan': {'duty': 25, 'profile': [None]*21},
+            'pump': {'duty': 60, 'profile': [None]*21},
+        }
+
+    def duty(self, channel):
+        """Current duty of `channel`, following the profile if one is set."""
+        state = self.speed[channel]
+        points = [p for p in state['profile'] if p]
+        if len(points) < len(state['profile']):
+            return state['duty']
+        duty = points[0][1]
+        for temp, pduty in points:
+            if temp <= self.liquid_temperature:
+                duty = pduty
+        return duty
+
+    def _handle_write(self, packet):
+        if packet[0] != 0x2:
+            LOGGER.debug('ignoring unknown packet %02x', packet[0])
+        elif packet[1] == 0x4c:
+            channel = ['sync', 'logo', 'ring'][packet[2] & 0x7]
+            seq = packet[4] >> 5
+            state = self.lighting.setdefault(channel, {'steps': {}})
+            if seq == 0:
+                state['steps'] = {}
+            state['mode'] = packet[3]
+            state['speed'] = packet[4] & 0x7
+            state['steps'][seq] = bytes(packet[5:32])
+            if channel == 'sync':
+                self.lighting.pop('logo', None)
+                self.lighting.pop('ring', None)
+            else:
+                self.lighting.pop('sync', None)
+        elif packet[1] == 0x4d and self.device_type != 'Kraken M':
+            channel = 'pump' if packet[2] & 0x40 else 'fan'
+            if packet[2] & 0x80:
+                self.speed[channel]['profile'][packet[2] & 0x1f] = (packet[3], packet[4])
+            else:
+                self.speed[channel]['duty'] = packet[4]
+                self.speed[channel]['profile'] = [None]*21
+
+    def _next_report(self):
+        report = bytearray(64)
+        report[0] = 0x04
+        temp = self.liquid_temperature + self._random.uniform(-0.2, 0.2)
+        report[1], report[2] = int(temp), int(temp*10) % 10
+        if self.device_type != 'Kraken M':
+            fan = round(self.duty('fan')*19 + self._random.uniform(-10, 10))
+            pump = round(self.duty('pump')*28 + self._random.uniform(-15, 15))
+            report[3], report[4] = fan >> 8, fan & 0xff
+            report[5], report[6] = pump >> 8, pump & 0xff
+        major, minor, patch = self.firmware
+        report[0xb], report[0xc], report[0xd], report[0xe] = major, minor >> 8, minor & 0xff, patch
+        return bytes(report)
+
+
+class SimulatedSmartDevice(SimulatedUsbDevice):
+    """Simulated NZXT Smart Device or Grid+ V3."""
+
+    def __init__(self, speed_channel_count=3, color_channel_count=1, fans=None,
+                 led_accessories=2, led_type='Hue+ Strip', firmware=(1, 0, 7),
+                 noise_level=32, reporting=True, **kwargs):
+        pid = 0x1714 if color_channel_count else 0x1711
+        super().__init__(0x1e71, pid, **kwargs)
+        self.firmware = firmware
+        self.noise_level = noise_level
+        self.reporting = reporting
+        self.fans = list(fans or ['PWM']*speed_channel_count)
+        self.duties = [40]*speed_channel_count
+        self.led_accessories = led_accessories if color_channel_count else 0
+        self.led_type = led_type
+        self.lighting = {}  # {'mode', 'variant', 'speed', 'steps': {seq: leds}}
+        self._pending = None
+        self._channel = 0
+
+    def _handle_write(self, packet):
+        if packet[0] == 0x1 and packet[1] == 0x5d:
+            self.reporting = True
+        elif packet[0] == 0x2 and packet[1] == 0x4b:
+            self._pending = packet
+        elif packet[0] == 0x3 and self._pending is not None:
+            first, self._pending = self._pending, None
+            seq = first[4] >> 5
+            if seq == 0:
+                self.lighting = {'steps': {}}
+            self.lighting.update(mode=first[2], variant=first[3], speed=first[4] & 0x7)
+            self.lighting['steps'][seq] = bytes(first[5:62] + packet[1:64])
+        elif packet[0] == 0x2 and packet[1] == 0x4d:
+            self.duties[packet[2]] = packet[4]
+        elif packet[0] != 0x1:
+            LOGGER.debug('ignoring unknown packet %02x', packet[0])
+
+    def _next_report(self):
+        if not self.reporting:
+            return None
+        cid = self._channel
+        self._channel = (self._channel + 1) % len(self.fans)
+        report = bytearray(21)
+        report[0] = 0x04
+        report[1] = max(0, self.noise_level + self._random.randint(-1, 1))
+        mode = self.fans[cid]
+        state = {None: 0, 'DC': 1, 'PWM': 2}[mode]
+        if state:
+            duty = self.duties[cid]
+            rpm = round(duty*18 + self._random.uniform(-10, 10))
+            volts = 12.0 if mode == 'PWM' else 12.0*duty/100
+            amps = 0.05 + duty/500
+            report[3], report[4] = rpm >> 8, rpm & 0xff
+            report[7], report[8] = int(volts), round(volts*100) % 100
+            report[10] = round(amps*100)
+        major, minor, patch = self.firmware
+        report[0xb], report[0xc], report[0xd], report[0xe] = major, minor >> 8, minor & 0xff, patch
+        report[15] = cid << 4 | state
+        report[16] = ['Hue+ Strip', 'Aer RGB'].index(self.led_type) << 3
+        report[17] = self.led_accessories
+        return bytes(report)
+
+
+class SimulatedBackend(object):
+    """Stand-in for `usb.core` that finds simulated devices.
+
+    Pass it as the `backend` of `BaseUsbDriver.find_supported_devices`.
+    """
+
+    def __init__(self, devices=()):
+        self.devices = list(devices)
+
+    def add(self, device):
+        self.devices.append(device)
+        return device
+
+    def remove(self, device):
+        self.devices.remove(device)
+
+    def find(self, find_all=False, **kwargs):
+        """Find devices by attribute values; mimics `usb.core.find`."""
+        found = [dev for dev in self.devices
+                 if all(getattr(dev, k) == v for k, v in kwargs.items())]
+        if find_all:
+            return found
+        return found[0] if found else None
@@ -0,0 +1,102 @@
+"""Typed status records.
+
+Each driver reports its status following a stable `StatusSchema`, and returns
+it in a compact `StatusRecord`.  Metrics can be accessed in constant time by
+their position in the schema (resolved once, outside of hot loops) or by
+key; units are kept in the schema, as metadata.
+
+    >>> schema = StatusSchema([('Liquid temperature', '°C'), ('Fan speed', 'rpm')])
+    >>> temp = schema.index('Liquid temperature')
+    >>> rec = StatusRecord(schema, [30.5, None])
+    >>> rec[temp], rec['Liquid temperature'], schema.units[temp]
+    (30.5, 30.5, '°C')
+
+Iterating over a record yields the (key, value, unit) tuples of the metrics
+that are present, the same returned by `get_status()`.
+
+    >>> list(rec)
+    [('Liquid temperature', 30.5, '°C')]
+
+Copyright (C) 2018  Jonas Malaco
+Copyright (C) 2018  each contribution's author
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import time
+
+
+class StatusSchema(object):
+    """Ordered set of (key, unit) metrics reported by a driver."""
+
+    __slots__ = ('keys', 'units', '_index')
+
+    def __init__(self, metrics):
+        self.keys = tuple(key for key, _ in metrics)
+        self.units = tuple(unit for _, unit in metrics)
+        self._index = {key: i for i, key in enumerate(self.keys)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __repr__(self):
+        return 'StatusSchema({!r})'.format(list(zip(self.keys, self.units)))
+
+    def index(self, key):
+        """Get the metric id of `key`."""
+        return self._index[key]
+
+
+class StatusRecord(object):
+    """Values for the metrics in a schema; None for the ones not available.
+
+    Records are flagged `partial` when some reports could not be read in time.
+    """
+
+    __slots__ = ('schema', 'values', 'timestamp', 'partial')
+
+    def __init__(self, schema, values=None, timestamp=None, partial=False):
+        self.schema = schema
+        self.values = values if values is not None else [None]*len(schema)
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.partial = partial
+
+    def __getitem__(self, metric):
+        """Get a value by metric id or key."""
+        if isinstance(metric, str):
+            metric = self.schema.index(metric)
+        return self.values[metric]
+
+    def __setitem__(self, metric, value):
+        if isinstance(metric, str):
+            metric = self.schema.index(metric)
+        self.values[metric] = value
+
+    def __iter__(self):
+        for key, value, unit in zip(self.schema.keys, self.values, self.schema.units):
+            if value is not None:
+                yield (key, value, unit)
+
+    def __repr__(self):
+        return 'StatusRecord({!r})'.format(list(self))
+
+    def get(self, key, default=None):
+        """Get a value by key, or `default` if unknown or not available."""
+        i = self.schema._index.get(key)
+        if i is None or self.values[i] is None:
+            return default
+        return self.values[i]
@@ -0,0 +1,93 @@
+"""Binary trace of USB transfers.
+
+A `TransferTrace` keeps the most recent transfers of a driver in preallocated
+buffers, without formatting them.  It is cheap enough to leave enabled in
+production, and can be dumped on demand when diagnosing issues:
+
+    dev.trace = TransferTrace(capacity=256)
+    ...
+    dev.trace.dump()
+
+    >>> trace = TransferTrace(capacity=2, max_length=4)
+    >>> for packet in ([0x2, 0x4d, 0x0, 0x0, 0x32], [0x4, 0x1e], [0x4, 0x1f]):
+    ...     trace.record(0x1 if packet[0] == 0x2 else 0x81, packet)
+    >>> [(endpoint, data.hex()) for _, endpoint, data in trace.entries()]
+    [(129, '041e'), (129, '041f')]
+
+Copyright (C) 2018  Jonas Malaco
+Copyright (C) 2018  each contribution's author
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import array
+import sys
+import threading
+import time
+
+
+class TransferTrace(object):
+    """Ring buffer of the last `capacity` transfers, truncated to `max_length`."""
+
+    def __init__(self, capacity=1024, max_length=65):
+        self.capacity = capacity
+        self.max_length = max_length
+        self._data = bytearray(capacity*max_length)
+        self._times = array.array('d', [0.0])*capacity
+        self._endpoints = array.array('B', [0])*capacity
+        self._lengths = array.array('H', [0])*capacity
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def record(self, endpoint, data):
+        """Record a transfer of `data` on `endpoint`."""
+        now = time.monotonic()
+        length = min(len(data), self.max_length)
+        with self._lock:
+            i = self._next
+            offset = i*self.max_length
+            self._data[offset:offset + length] = bytes(data[:length])
+            self._times[i] = now
+            self._endpoints[i] = endpoint
+            self._lengths[i] = length
+            self._next = (i + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+
+    def entries(self):
+        """Get the recorded (monotonic time, endpoint, data) tuples, oldest first."""
+        with self._lock:
+            first = (self._next - self._count) % self.capacity
+            res = []
+            for i in ((first + k) % self.capacity for k in range(self._count)):
+                offset = i*self.max_length
+                data = bytes(self._data[offset:offset + self._lengths[i]])
+                res.append((self._times[i], self._endpoints[i], data))
+            return res
+
+    def clear(self):
+        with self._lock:
+            self._next = 0
+            self._count = 0
+
+    def dump(self, file=None):
+        """Write the recorded transfers in human readable form."""
+        file = file or sys.stderr
+        for timestamp, endpoint, data in self.entries():
+            direction = 'in ' if endpoint & 0x80 else 'out'
+            file.write('{:14.6f}  {:02x} {}  {}\n'.format(
+                timestamp, endpoint, direction, ' '.join(format(i, '02x') for i in data)))
@@ -0,0 +1,116 @@
+"""Streaming of status records.
+
+A `StatusStream` formats status records as compact JSON Lines or CSV, and
+writes them from a background thread through a bounded buffer: a slow
+consumer (a pipe, a network file system) never stalls sampling, and records
+are dropped, and counted, if the buffer fills up.
+
+    >>> import io
+    >>> from liquidctl.driver.status import StatusRecord, StatusSchema
+    >>> schema = StatusSchema([('Liquid temperature', '°C'), ('Fan speed', 'rpm')])
+    >>> out = io.StringIO()
+    >>> stream = StatusStream(out, fmt='jsonl')
+    >>> stream.write(0, 'NZXT Kraken X', StatusRecord(schema, [30.5, None], timestamp=1545000000.0))
+    >>> stream.close()
+    >>> print(out.getvalue(), end='')
+    {"time":1545000000.0,"device":0,"description":"NZXT Kraken X","status":{"Liquid temperature":30.5}}
+
+In CSV, each value is written to a (time, device, key, value, unit) row.
+
+Copyright (C) 2018  Jonas Malaco
+Copyright (C) 2018  each contribution's author
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import csv
+import io
+import json
+import logging
+import queue
+import threading
+
+
+LOGGER = logging.getLogger(__name__)
+
+FORMATS = ['jsonl', 'csv']
+
+_BUFFER_SIZE = 1024  # records
+_CSV_HEADER = ['time', 'device', 'key', 'value', 'unit']
+
+
+class StatusStream(object):
+    """Write status records to `file` in `fmt` (jsonl or csv).
+
+    Unless `header` is false, CSV output starts with a header row.
+    """
+
+    def __init__(self, file, fmt='jsonl', buffer_size=_BUFFER_SIZE, header=True):
+        if fmt not in FORMATS:
+            raise ValueError('Unknown format {}, use one of: {}'.format(fmt, ', '.join(FORMATS)))
+        self.file = file
+        self.fmt = fmt
+        self.dropped = 0
+        self.failed = None  # the write error, if the output became unusable
+        self._queue = queue.Queue(buffer_size)
+        self._thread = threading.Thread(target=self._run, name='liquidctl stream', daemon=True)
+        if fmt == 'csv' and header:
+            self._queue.put(_format_csv([_CSV_HEADER]))
+        self._thread.start()
+
+    def write(self, num, description, record):
+        """Queue a record of device number `num`; never blocks."""
+        if self.fmt == 'jsonl':
+            obj = {
+                'time': record.timestamp,
+                'device': num,
+                'description': description,
+                'status': {k: v for k, v, _ in record},
+            }
+            if record.partial:
+                obj['partial'] = True
+            line = json.dumps(obj, ensure_ascii=False, separators=(',', ':')) + '\n'
+        else:
+            line = _format_csv([record.timestamp, num, k, v, u] for k, v, u in record)
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 100 == 0:
+                LOGGER.warning('output too slow, %i records dropped so far', self.dropped)
+
+    def close(self):
+        """Flush any buffered records and stop the writer."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            line = self._queue.get()
+            if line is None:
+                return
+            if self.failed:
+                continue
+            try:
+                self.file.write(line)
+                if self._queue.empty():
+                    self.file.flush()
+            except (OSError, ValueError) as err:
+                self.failed = err
+
+
+def _format_csv(rows):
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator='\n').writerows(rows)
+    return buf.getvalue()
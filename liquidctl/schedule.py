@@ -0,0 +1,82 @@
+"""Drift-free periodic scheduling.
+
+A `Ticker` schedules ticks at fixed multiples of an interval from the first
+one, so that the time spent handling each tick does not accumulate into
+drift.  Ticks that can no longer be met are skipped, and counted, instead of
+being run in a burst.
+
+    >>> class Clock:  # manually advanced, for the example
+    ...     now = 0.0
+    ...     def __call__(self):
+    ...         return self.now
+    ...     def sleep(self, seconds):
+    ...         self.now += seconds
+    >>> clock = Clock()
+    >>> ticker = Ticker(1.0, clock=clock, sleep=clock.sleep)
+    >>> ticker.wait(), ticker.wait()
+    (0.0, 1.0)
+    >>> clock.now += 2.5  # handling the tick took too long
+    >>> ticker.wait(), ticker.wait(), ticker.missed
+    (3.0, 4.0, 1)
+
+Copyright (C) 2018  Jonas Malaco
+Copyright (C) 2018  each contribution's author
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import math
+import time
+
+
+class Ticker(object):
+    """Periodic schedule with a fixed `interval`, in seconds.
+
+    `clock` and `sleep` default to `time.monotonic` and `time.sleep`.  A
+    `sleep` that returns true, like `threading.Event().wait`, cancels the
+    schedule: `wait()` then returns None, and iteration stops.
+    """
+
+    def __init__(self, interval, clock=time.monotonic, sleep=time.sleep):
+        if interval <= 0:
+            raise ValueError('interval must be positive')
+        self.interval = interval
+        self.clock = clock
+        self.sleep = sleep
+        self.start = None
+        self.ticks = 0
+        self.missed = 0
+
+    def wait(self):
+        """Wait for the next tick, and return the time it was scheduled for."""
+        now = self.clock()
+        if self.start is None:
+            self.start = now
+        target = self.start + self.ticks*self.interval
+        if now >= target + self.interval:
+            latest = math.floor((now - self.start)/self.interval)
+            self.missed += latest - self.ticks
+            self.ticks = latest
+            target = self.start + latest*self.interval
+        if target > now and self.sleep(target - now):
+            return None
+        self.ticks += 1
+        return target
+
+    def __iter__(self):
+        while True:
+            tick = self.wait()
+            if tick is None:
+                return
+            yield tick
@@ -0,0 +1,566 @@
+"""Software control of many devices and channels.
+
+A control file describes, in TOML, how the speed of each channel follows a
+temperature:
+
+    interval = 1                # seconds between ticks; optional
+
+    [sensors]                   # aliases for sensor names; optional
+    liquid = "kraken:Liquid temperature"
+    cpu = "coretemp:Package id 0"
+
+    [[device]]
+    name = "kraken"             # prefix of the device's sensors
+    product = 0x170e            # select devices like in apply
+    [device.speed.pump]
+    sensor = "liquid"
+    curve = [[20, 50], [40, 100]]
+    [device.speed.fan]
+    sensor = "max(liquid, cpu - 25)"
+    pid = { setpoint = 35, kp = 5, ki = 0.1, kf = 2 }
+    disturbance = "cpu"         # feed-forward from the slope of the CPU temperature
+    min-step = 3                # governor: hysteresis, min-step, max-rate
+
+    [[device]]
+    name = "grid"
+    product = 0x1711
+    [device.speed.fan1]
+    sensor = "'coretemp:Package id 0'"
+    curve = [[30, 25], [70, 100]]
+    critical = 85               # temperature for the 100% failsafe; optional
+
+Curves are (temperature, duty) integer points, like in krakencurve-poc.
+Temperatures range from 0 up to a critical temperature, at which duty is
+always 100%: by default, 60°C for channels following liquid temperatures
+only, and 100°C for the others.  Duties must be within the range of the
+channel (see `get_speed_channels()`).
+
+Sensors are named <device name>:<status key>, for the status of the devices
+in the file, or <chip>:<label>, for the temperatures of the host (which
+requires psutil).  A sensor expression combines sensors, by alias or by
+quoted name, with numbers, arithmetic and the max, min and mean functions:
+
+    >>> expr = SensorExpression("max(liquid, 'coretemp:Package id 0' - 20)",
+    ...                         aliases={'liquid': 'kraken:Liquid temperature'})
+    >>> sorted(expr.sensors)
+    ['coretemp:Package id 0', 'kraken:Liquid temperature']
+    >>> expr({'kraken:Liquid temperature': 31.5, 'coretemp:Package id 0': 55.0})
+    35.0
+
+A single scheduler ticks all devices at the same rate, but each device, and
+the reading of host sensors, is handled by a worker of its own: a device that
+is slow or timing out only skips its own ticks.  A channel whose sensors stay unavailable for longer
+than `max-sensor-age` seconds is set to its maximum duty.
+
+Copyright (C) 2018  Jonas Malaco
+Copyright (C) 2018  each contribution's author
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import ast
+import logging
+import operator
+import queue
+import statistics
+import threading
+import time
+
+from liquidctl.batch import SELECTION_KEYS, matches
+from liquidctl.control import CurveControl, Governor, PidControl, duty_range
+from liquidctl.schedule import Ticker
+from liquidctl.util import CompiledProfile
+
+
+LOGGER = logging.getLogger(__name__)
+
+_DEFAULT_INTERVAL = 1.0       # s
+_DEFAULT_MAX_SENSOR_AGE = 10.0  # s
+_LIQUID_CRITICAL = 60           # °C
+_DEFAULT_CRITICAL = 100         # °C
+_TOP_LEVEL_KEYS = ['interval', 'max-sensor-age', 'sensors', 'device']
+_DEVICE_KEYS = SELECTION_KEYS + ['name', 'speed']
+_CHANNEL_KEYS = ['sensor', 'curve', 'pid', 'disturbance', 'critical', 'hysteresis', 'min-step',
+                 'max-rate']
+_PID_KEYS = ['setpoint', 'kp', 'ki', 'kd', 'kf']
+_GOVERNOR_KEYS = {'hysteresis': 'hysteresis', 'min-step': 'min_step', 'max-rate': 'max_rate'}
+
+_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+_FUNCTIONS = {
+    'max': max,
+    'min': min,
+    'mean': lambda *args: statistics.mean(args),
+}
+
+
+class SensorExpression(object):
+    """A temperature computed from sensors, compiled once.
+
+    Names are looked up in `aliases`, and quoted strings are sensor names.
+    Calling the expression with a {sensor: value} mapping evaluates it, and
+    raises KeyError if a sensor is missing.
+    """
+
+    def __init__(self, text, aliases=None):
+        self.text = text
+        self.sensors = set()
+        self._aliases = aliases or {}
+        try:
+            tree = ast.parse(text.strip(), mode='eval')
+        except SyntaxError as err:
+            raise ValueError('invalid sensor expression {!r}: {}'.format(text, err.msg)) from None
+        self._eval = self._compile(tree.body)
+
+    def __call__(self, values):
+        return self._eval(values)
+
+    def __repr__(self):
+        return 'SensorExpression({!r})'.format(self.text)
+
+    def _compile(self, node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            return self._sensor(node.value)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) \
+                and not isinstance(node.value, bool):
+            value = node.value
+            return lambda values: value
+        if isinstance(node, ast.Name):
+            if node.id not in self._aliases:
+                raise ValueError('unknown sensor alias {} in {!r}'.format(node.id, self.text))
+            return self._sensor(self._aliases[node.id])
+        if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+            op, left, right = _OPERATORS[type(node.op)], self._compile(node.left), self._compile(node.right)
+            return lambda values: op(left(values), right(values))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _OPERATORS:
+            op, operand = _OPERATORS[type(node.op)], self._compile(node.operand)
+            return lambda values: op(operand(values))
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+                and node.func.id in _FUNCTIONS and node.args and not node.keywords:
+            func, args = _FUNCTIONS[node.func.id], [self._compile(arg) for arg in node.args]
+            return lambda values: func(*(arg(values) for arg in args))
+        raise ValueError('unsupported sensor expression {!r}'.format(self.text))
+
+    def _sensor(self, name):
+        self.sensors.add(name)
+        return lambda values: values[name]
+
+
+class Sensors(object):
+    """Latest values of the sensors, shared by all device workers."""
+
+    def __init__(self):
+        self._values = {}  # name -> (value, timestamp)
+        self._lock = threading.Lock()
+
+    def update(self, items, timestamp=None):
+        """Store (name, value) items, read at `timestamp` (default: now)."""
+        timestamp = timestamp or time.time()
+        items = list(items)  # read the sensors before holding up other workers
+        with self._lock:
+            for name, value in items:
+                if isinstance(value, (int, float)):
+                    self._values[name] = (value, timestamp)
+
+    def fresh(self, max_age):
+        """Get a {name: value} mapping of the values at most `max_age` seconds old."""
+        oldest = time.time() - max_age
+        with self._lock:
+            return {name: value for name, (value, timestamp) in self._values.items()
+                    if timestamp >= oldest}
+
+
+class Channel(object):
+    """A speed channel of a device, following a sensor expression.
+
+    Sensor values older than `max_sensor_age` are not passed to `step()`: a
+    channel missing any of its sensors, once it has been running for that
+    long, is set to its failsafe (maximum) duty.
+
+        >>> from liquidctl.control import CurveControl
+        >>> from liquidctl.driver.kraken_two import KrakenTwoDriver
+        >>> from liquidctl.driver.simulated import SimulatedBackend, SimulatedKrakenTwo
+        >>> kraken = SimulatedKrakenTwo()
+        >>> dev, = KrakenTwoDriver.find_supported_devices(backend=SimulatedBackend([kraken]))
+        >>> pump = Channel(dev, 'pump', SensorExpression("'kraken:Liquid temperature'"),
+        ...                CurveControl([(20, 50), (40, 100)]))
+        >>> sensors = Sensors()
+        >>> sensors.update([('kraken:Liquid temperature', 30.0)])
+        >>> pump.step(sensors.fresh(5), now=0, max_sensor_age=5); kraken.duty('pump')
+        75
+        >>> sensors.update([('kraken:Liquid temperature', 30.0)], time.time() - 6)  # stale report
+        >>> pump.step(sensors.fresh(5), now=6, max_sensor_age=5); kraken.duty('pump')
+        100
+    """
+
+    def __init__(self, dev, name, sensor, control, disturbance=None):
+        self.dev = dev
+        self.name = name
+        self.sensor = sensor
+        self.control = control
+        self.disturbance = disturbance
+        self.failsafe = duty_range(dev, name)[1]
+        self.failures = 0
+        self._started = None
+        self._missing = False
+        # prefer writes that do not reprogram persistent settings, like profiles
+        self._instantaneous = hasattr(dev, 'set_instantaneous_speed')
+
+    @property
+    def sensors(self):
+        """Names of the sensors used."""
+        return self.sensor.sensors | (self.disturbance.sensors if self.disturbance else set())
+
+    def step(self, values, now, max_sensor_age, deadline=None):
+        """Update the duty for the sensor `values`, writing it if needed."""
+        if self._started is None:
+            self._started = now
+        try:
+            if self.disturbance:
+                duty = self.control.update(self.sensor(values), self.disturbance(values))
+            else:
+                duty = self.control.update(self.sensor(values))
+        except KeyError as err:
+            if not self._missing:
+                self._missing = True
+                LOGGER.info('%s, %s: sensor %s unavailable', self.dev.description, self.name, err)
+            # values are at most max_sensor_age old: a missing sensor has not
+            # been read for that long, unless the channel has just started
+            if now - self._started < max_sensor_age:
+                return
+            if self.control.governor.duty == self.failsafe:
+                return
+            LOGGER.warning('%s, %s: sensors unavailable for %.0f s, failsafe to %i%%',
+                           self.dev.description, self.name, max_sensor_age, self.failsafe)
+            self.control.governor.reset()
+            duty = self.control.governor.update(self.failsafe)
+        else:
+            self._missing = False
+        if duty is None:
+            return
+        self._write(duty, deadline)
+        self.control.governor.commit()
+
+    def _write(self, duty, deadline):
+        if self._instantaneous:
+            self.dev.set_instantaneous_speed(self.name, duty, deadline=deadline)
+        else:
+            self.dev.set_fixed_speed(self.name, duty, deadline=deadline)
+
+
+class _TickWorker(object):
+    """Handle ticks in a thread of its own.
+
+    Ticks arrive from the scheduler through a single slot: while the worker
+    is still busy with a tick, each new one replaces the one pending, which
+    is skipped (and counted in `skipped`).  A slow worker never holds up the
+    others, and always resumes with the latest tick.
+    """
+
+    description = None
+
+    def __init__(self, name):
+        self.skipped = 0
+        self._ticks = queue.Queue(1)
+        self._thread = threading.Thread(target=self._run, name='liquidctl {}'.format(name),
+                                        daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def tick(self, tick):
+        """Schedule a tick, replacing any still pending; never blocks."""
+        try:
+            self._ticks.get_nowait()
+        except queue.Empty:
+            pass
+        else:
+            self.skipped += 1
+            if self.skipped == 1 or self.skipped % 100 == 0:
+                LOGGER.warning('%s: too slow, %i ticks skipped so far',
+                               self.description, self.skipped)
+        # only the scheduler puts ticks, so the slot is free by now
+        self._ticks.put_nowait(tick)
+
+    def stop(self):
+        """Stop the worker, after the tick in progress."""
+        self._ticks.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            tick = self._ticks.get()
+            if tick is None:
+                return
+            self._step(tick)
+
+    def _step(self, tick):
+        raise NotImplementedError()
+
+
+class DeviceWorker(_TickWorker):
+    """Run the channels of a device in a thread of its own.
+
+    A device still busy with a tick skips the next ones (see `_TickWorker`),
+    and resumes with the latest tick and its deadline.  A channel that fails
+    does not hold up the others either: its failed ticks are counted in its
+    `failures`.
+    """
+
+    def __init__(self, name, dev, channels, sensors, interval, max_sensor_age,
+                 read_status=True):
+        super().__init__(name)
+        self.name = name
+        self.dev = dev
+        self.channels = channels
+        self.sensors = sensors
+        self.interval = interval
+        self.max_sensor_age = max_sensor_age
+        self.read_status = read_status
+
+    @property
+    def description(self):
+        return self.dev.description
+
+    def start(self):
+        self.dev.connect(session=True)
+        if self.read_status:
+            self.dev.start_background_reader()
+        super().start()
+
+    def stop(self):
+        """Stop the worker, after the tick in progress, and disconnect."""
+        super().stop()
+        self.dev.disconnect()
+
+    def _step(self, tick):
+        deadline = tick + self.interval
+        if self.read_status:
+            try:
+                record = self.dev.get_status_record(deadline=deadline)
+                prefix = self.name + ':'
+                self.sensors.update(((prefix + k, v) for k, v, _ in record), record.timestamp)
+            except Exception as err:
+                LOGGER.info('%s: failed to read status: %s', self.dev.description, err)
+        values = self.sensors.fresh(self.max_sensor_age)
+        for channel in self.channels:
+            try:
+                channel.step(values, tick, self.max_sensor_age, deadline)
+            except Exception as err:
+                channel.failures += 1
+                if channel.failures == 1 or channel.failures % 100 == 0:
+                    LOGGER.warning('%s, %s: %s (%i failed ticks so far)', self.dev.description,
+                                   channel.name, err, channel.failures)
+
+
+class HostSensorWorker(_TickWorker):
+    """Read the temperatures of the host with `psutil`, in a thread of its own."""
+
+    description = 'host sensors'
+
+    def __init__(self, psutil, sensors):
+        super().__init__(self.description)
+        self.psutil = psutil
+        self.sensors = sensors
+
+    def _step(self, tick):
+        try:
+            self.sensors.update(_host_temperatures(self.psutil))
+        except Exception as err:
+            LOGGER.info('failed to read host sensors: %s', err)
+
+
+class ControlService(object):
+    """Drive the channels of many devices from a single scheduler.
+
+    `workers` are DeviceWorker instances; host temperatures are read with
+    `psutil`, if given, on every tick, by a HostSensorWorker of their own.
+    """
+
+    def __init__(self, workers, sensors, interval=_DEFAULT_INTERVAL, psutil=None):
+        self.workers = workers
+        self.sensors = sensors
+        self.interval = interval
+        self.psutil = psutil
+        self.ticker = None
+        self._stop = threading.Event()
+
+    def run(self):
+        """Run until stop() is called."""
+        workers = list(self.workers)
+        if self.psutil:
+            workers.insert(0, HostSensorWorker(self.psutil, self.sensors))
+        started = []
+        try:
+            for worker in workers:
+                worker.start()
+                started.append(worker)
+            self.ticker = Ticker(self.interval, sleep=self._stop.wait)
+            for tick in self.ticker:
+                for worker in workers:
+                    worker.tick(tick)
+        finally:
+            for worker in started:
+                worker.stop()
+
+    def stop(self):
+        """Stop a running service."""
+        self._stop.set()
+
+    def stats(self):
+        """Get (device description, channel, writes sent, updates suppressed, failed ticks) tuples."""
+        return [(w.dev.description, c.name, c.control.governor.sent, c.control.governor.suppressed,
+                 c.failures)
+                for w in self.workers for c in w.channels]
+
+
+def plan(config, devices, psutil=None):
+    """Validate a control file against (listing number, driver) pairs.
+
+    Returns a ControlService, ready to run.  Raises `ValueError` if the
+    configuration is invalid.
+    """
+    unknown = set(config) - set(_TOP_LEVEL_KEYS)
+    if unknown:
+        raise ValueError('unknown keys: {}'.format(', '.join(sorted(unknown))))
+    interval = float(config.get('interval', _DEFAULT_INTERVAL))
+    max_sensor_age = float(config.get('max-sensor-age', _DEFAULT_MAX_SENSOR_AGE))
+    if interval <= 0 or max_sensor_age <= 0:
+        raise ValueError('interval and max-sensor-age must be positive')
+    aliases = config.get('sensors', {})
+    sensors = Sensors()
+    entries = []
+    for i, entry in enumerate(config.get('device', []), 1):
+        try:
+            entries.append(_plan_device(entry, devices, aliases))
+        except (TypeError, ValueError) as err:
+            raise ValueError('device entry {}: {}'.format(i, err)) from None
+    names = [name for name, _, _ in entries]
+    if len(set(names)) != len(names):
+        raise ValueError('device names must be unique')
+    used = set().union(*(ch.sensors for _, _, channels in entries for ch in channels))
+    host = {s for s in used if s.split(':', 1)[0] not in names}
+    if host and not psutil:
+        raise ValueError('reading host sensors requires psutil: {}'.format(', '.join(sorted(host))))
+    workers = [DeviceWorker(name, dev, channels, sensors, interval, max_sensor_age,
+                            read_status=any(s.startswith(name + ':') for s in used))
+               for name, dev, channels in entries]
+    return ControlService(workers, sensors, interval, psutil=psutil if host else None)
+
+
+def _plan_device(entry, devices, aliases):
+    unknown = set(entry) - set(_DEVICE_KEYS)
+    if unknown:
+        raise ValueError('unknown keys: {}'.format(', '.join(sorted(unknown))))
+    selected = [(num, dev) for num, dev in devices if matches(num, dev, entry)]
+    if len(selected) != 1:
+        raise ValueError('selection matches {} devices, instead of one'.format(len(selected)))
+    num, dev = selected[0]
+    name = entry.get('name', 'device{}'.format(num))
+    if ':' in name:
+        raise ValueError('device name cannot contain colons: {}'.format(name))
+    speeds = dev.get_speed_channels()
+    channels = []
+    for channel, setting in entry.get('speed', {}).items():
+        if channel not in speeds:
+            raise ValueError('unknown speed channel {} for {}'.format(channel, dev.description))
+        channels.append(_plan_channel(dev, channel, setting, aliases))
+    return name, dev, channels
+
+
+def _plan_channel(dev, channel, setting, aliases):
+    unknown = set(setting) - set(_CHANNEL_KEYS)
+    if unknown:
+        raise ValueError('unknown keys in speed.{}: {}'.format(channel, ', '.join(sorted(unknown))))
+    if 'sensor' not in setting or ('curve' in setting) == ('pid' in setting):
+        raise ValueError('speed.{} requires a sensor, and either a curve or pid'.format(channel))
+    sensor = SensorExpression(setting['sensor'], aliases)
+    disturbance = SensorExpression(setting['disturbance'], aliases) if 'disturbance' in setting else None
+    liquid = all(name.endswith(':Liquid temperature') for name in sensor.sensors)
+    critical = setting.get('critical', _LIQUID_CRITICAL if liquid else _DEFAULT_CRITICAL)
+    if not _is_int(critical) or critical <= 0:
+        raise ValueError('speed.{}: critical must be a positive integer'.format(channel))
+    limits = duty_range(dev, channel)
+    governor = Governor(duty_range=limits,
+                        **{arg: float(setting[key]) for key, arg in _GOVERNOR_KEYS.items()
+                           if key in setting})
+    if 'curve' in setting:
+        if disturbance:
+            raise ValueError('speed.{}: disturbance requires pid'.format(channel))
+        try:
+            curve = _parse_curve(setting['curve'], critical, *limits)
+        except ValueError as err:
+            raise ValueError('speed.{}: {}'.format(channel, err)) from None
+        control = CurveControl(CompiledProfile(curve, critx=critical), governor)
+    else:
+        pid = setting['pid']
+        unknown = set(pid) - set(_PID_KEYS)
+        if unknown or 'setpoint' not in pid or 'kp' not in pid:
+            raise ValueError('speed.{}.pid requires setpoint and kp, and accepts: {}'
+                             .format(channel, ', '.join(_PID_KEYS)))
+        if not 0 <= pid['setpoint'] < critical:
+            raise ValueError('speed.{}: setpoint must be between 0 and {}'
+                             .format(channel, critical - 1))
+        control = PidControl(duty_range=limits, governor=governor,
+                             **{key: float(value) for key, value in pid.items()})
+    return Channel(dev, channel, sensor, control, disturbance)
+
+
+def _parse_curve(curve, critical, minduty, maxduty):
+    """Validate a [[temperature, duty], ...] curve.
+
+    Like parse_profile in krakencurve-poc, temperatures must be integers
+    between 0 and `critical`, and duties integers between `minduty` and
+    `maxduty`.
+
+        >>> _parse_curve([[20, 50], [40, 90]], 60, 50, 100)
+        [(20, 50), (40, 90)]
+        >>> _parse_curve([[20, 50], [70, 90]], 60, 50, 100)
+        Traceback (most recent call last):
+            ...
+        ValueError: temperature must be integer between 0 and 60
+        >>> _parse_curve([[20, 30], [40, 90]], 60, 50, 100)
+        Traceback (most recent call last):
+            ...
+        ValueError: duty must be integer between 50 and 100
+    """
+    if not isinstance(curve, list) or not curve:
+        raise ValueError('curve must be a list of [temperature, duty] points')
+    points = []
+    for point in curve:
+        if not isinstance(point, list) or len(point) != 2:
+            raise ValueError('curve must be a list of [temperature, duty] points')
+        temp, duty = point
+        if not _is_int(temp) or temp < 0 or temp > critical:
+            raise ValueError('temperature must be integer between 0 and {}'.format(critical))
+        if not _is_int(duty) or duty < minduty or duty > maxduty:
+            raise ValueError('duty must be integer between {} and {}'.format(minduty, maxduty))
+        points.append((temp, duty))
+    return points
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _host_temperatures(psutil):
+    for chip, temps in psutil.sensors_temperatures().items():
+        for temp in temps:
+            yield '{}:{}'.format(chip, temp.label), temp.current
@@ -1,5 +1,22 @@
 """Utilities for profile manipulation.
 
+Profiles that are evaluated repeatedly should be compiled once, with
+`CompiledProfile`: lookups then take constant time for integer x (from a
+precomputed table) and logarithmic time otherwise, and many values, or many
+profiles, can be evaluated at once with NumPy.
+
+    >>> pump = CompiledProfile([(30, 40), (25, 25), (40, 80)], critx=60)
+    >>> pump(33), pump(33.5), pump(70)
+    (52, 54, 100)
+    >>> pump.evaluate([20, 33, 45]).tolist()
+    [25, 52, 85]
+    >>> fan = CompiledProfile([(20, 30), (50, 100)])
+    >>> evaluate_profiles([pump, fan], [20, 33, 45]).tolist()
+    [[25, 52, 85], [30, 60, 88]]
+
+Batch evaluation requires NumPy, which is otherwise not a dependency of
+liquidctl.
+
 Copyright (C) 2018  Jonas Malaco
 Copyright (C) 2018  each contribution's author
 
@@ -17,9 +34,14 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import bisect
 import itertools
+import math
 import sys
 
+_LUT_MAX_SPAN = 256  # largest range of integer x values kept in a table
+_METRICS = ['max', 'area']
+
 
 def delta(profile):
     """Compute a profile's Δx and Δy."""
@@ -90,6 +112,70 @@ def autofill_profile(profile, n):
     return list(itertools.chain(*tmp)) + profile[-1:]
 
 
+def optimize_profile(profile, n, metric='max'):
+    """Choose up to n points minimizing the error of a device that does not interpolate.
+
+    Requires the profile to be sorted by x, with no duplicate x values (see
+    normalize_profile).  The device is assumed to hold the y value of the last
+    point at or before x, and the points are chosen, by dynamic programming,
+    to minimize either the maximum (`metric='max'`) or the integrated
+    (`metric='area'`) difference between that step function and the linearly
+    interpolated profile.
+
+    Candidate points are at every x value in the profile and at every integer
+    x in between; the first and last candidates are always kept, and y values
+    are rounded to the nearest integer.
+
+    Takes O(n·m²) time and O(m²) memory, for m candidates.  Requires NumPy,
+    which is otherwise not a dependency of liquidctl.
+
+    >>> optimize_profile([(25, 25), (30, 40), (40, 80), (60, 100)], 7)
+    [(25, 25), (29, 37), (32, 48), (35, 60), (38, 72), (46, 86), (60, 100)]
+    >>> optimize_profile([(25, 25), (30, 40), (40, 80), (60, 100)], 7, metric='area')
+    [(25, 25), (29, 37), (33, 52), (36, 64), (40, 80), (50, 90), (60, 100)]
+    >>> optimize_profile([(25, 100), (60, 100)], 7)
+    [(25, 100), (60, 100)]
+    """
+    if metric not in _METRICS:
+        raise ValueError('unknown metric {}, use one of: {}'.format(metric, ', '.join(_METRICS)))
+    if n < 2:
+        raise ValueError('at least two points are required')
+    import numpy as np  # only needed for optimization; slow to import
+    curve = CompiledProfile(profile)
+    px, py = curve.xs, curve.ys
+    xs = sorted(set(px).union(range(math.ceil(px[0]), math.floor(px[-1]) + 1)))
+    fs = np.array([_linear(px, py, x) for x in xs], dtype='f8')
+    m = len(xs)
+    # dev[i, k]: deviation at candidate k while holding the value of i
+    dev = np.abs(fs[None, :] - np.rint(fs)[:, None])
+    # cost[i, j]: error between candidates i and j, if i is followed by j
+    if metric == 'max':
+        cost = np.maximum.accumulate(np.triu(dev), axis=1)
+        combine = np.maximum
+    else:
+        cost = np.zeros((m, m))
+        steps = (dev[:, :-1] + dev[:, 1:])/2*np.diff(np.asarray(xs, dtype='f8'))
+        cost[:, 1:] = np.cumsum(np.triu(steps), axis=1)
+        combine = np.add
+    cost[np.tril_indices(m)] = np.inf
+    # errs[j]: least error up to candidate j, with j as the k-th point
+    errs = np.full(m, np.inf)
+    errs[0] = 0
+    best, npoints, choices = errs[-1], 1, []
+    for k in range(2, min(n, m) + 1):
+        if best == 0:
+            break
+        candidates = combine(errs[:, None], cost)
+        choices.append(candidates.argmin(axis=0))
+        errs = candidates.min(axis=0)
+        if errs[-1] < best:
+            best, npoints = errs[-1], k
+    path = [m - 1]
+    for choice in reversed(choices[:npoints - 1]):
+        path.append(int(choice[path[-1]]))
+    return [(xs[i], round(float(fs[i]))) for i in reversed(path)]
+
+
 def interpolate_profile(profile, x):
     """Interpolate y given x and a [(x: int, y: int), ...] profile.
 
@@ -97,6 +183,9 @@ def interpolate_profile(profile, x):
     normalize_profile).  Expects profiles with integer x and y values, and
     returns duty rounded to the nearest integer.
 
+    Profiles used more than once should be compiled instead (see
+    CompiledProfile).
+
     >>> interpolate_profile([(20, 50), (50, 70), (60, 100)], 33)
     59
     >>> interpolate_profile([(20, 50), (50, 70)], 19)
@@ -106,13 +195,101 @@ def interpolate_profile(profile, x):
     >>> interpolate_profile([(20, 50)], 20)
     50
     """
-    lower, upper = profile[0], profile[-1]
-    for step in profile:
-        if step[0] <= x:
-            lower = step
-        if step[0] >= x:
-            upper = step
-            break
-    if lower[0] == upper[0]:
-        return lower[1]
-    return round(lower[1] + (x - lower[0])/(upper[0] - lower[0])*(upper[1] - lower[1]))
+    xs, ys = zip(*profile)
+    return _interpolate(xs, ys, x)
+
+
+class CompiledProfile(object):
+    """A [(x: int, y: int), ...] profile compiled for fast interpolation.
+
+    If `critx` is given, the profile is first normalized (see
+    normalize_profile); otherwise it must already be sorted by x, with no
+    duplicate x values, or ValueError is raised.
+
+    Calling the compiled profile interpolates y given x, with the same results
+    as interpolate_profile.
+    """
+
+    __slots__ = ['xs', 'ys', '_lut', '_lut_start']
+
+    def __init__(self, profile, critx=None):
+        if critx is not None:
+            profile = normalize_profile(profile, critx)
+        if not profile:
+            raise ValueError('empty profile')
+        self.xs, self.ys = (tuple(v) for v in zip(*profile))
+        if any(x >= xb for x, xb in zip(self.xs, self.xs[1:])):
+            raise ValueError('profile x values must be increasing: {}'.format(list(profile)))
+        self._lut = None
+        self._lut_start = self.xs[0]
+        if isinstance(self.xs[0], int) and isinstance(self.xs[-1], int) \
+                and self.xs[-1] - self.xs[0] <= _LUT_MAX_SPAN:
+            self._lut = tuple(_interpolate(self.xs, self.ys, x)
+                              for x in range(self.xs[0], self.xs[-1] + 1))
+
+    def __call__(self, x):
+        """Interpolate y given x."""
+        if self._lut is not None and type(x) is int:
+            i = x - self._lut_start
+            if i <= 0:
+                return self.ys[0]
+            if i >= len(self._lut):
+                return self.ys[-1]
+            return self._lut[i]
+        return _interpolate(self.xs, self.ys, x)
+
+    def __len__(self):
+        return len(self.xs)
+
+    def __repr__(self):
+        return 'CompiledProfile({})'.format(self.points())
+
+    def points(self):
+        """Return the profile as a [(x, y), ...] list."""
+        return list(zip(self.xs, self.ys))
+
+    def evaluate(self, x):
+        """Interpolate y for each x in a sequence or NumPy array (requires NumPy)."""
+        return evaluate_profiles([self], x)[0]
+
+
+def evaluate_profiles(profiles, x):
+    """Interpolate many compiled profiles at many x values (requires NumPy).
+
+    Returns a (len(profiles), len(x)) integer array.  Profiles can have
+    different numbers of points.
+    """
+    import numpy as np  # only needed for batch evaluation; slow to import
+    x = np.asarray(x, dtype='f8')
+    npoints = max(2, max(len(p) for p in profiles))
+    # pad shorter profiles by repeating their last point, which only matters
+    # for x past that point, where y is clamped anyway
+    xs = np.array([p.xs + p.xs[-1:]*(npoints - len(p)) for p in profiles], dtype='f8')
+    ys = np.array([p.ys + p.ys[-1:]*(npoints - len(p)) for p in profiles], dtype='f8')
+    # like bisect_left: the index of the first point with x value >= x
+    upper = np.count_nonzero(xs[:, :, None] < x, axis=1)
+    upper = np.clip(upper, 1, npoints - 1)
+    lower = upper - 1
+    x0, x1 = np.take_along_axis(xs, lower, 1), np.take_along_axis(xs, upper, 1)
+    y0, y1 = np.take_along_axis(ys, lower, 1), np.take_along_axis(ys, upper, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y = np.rint(y0 + (x - x0)/(x1 - x0)*(y1 - y0))
+    y = np.where(x <= xs[:, :1], ys[:, :1], y)
+    y = np.where(x >= xs[:, -1:], ys[:, -1:], y)
+    return y.astype(int)
+
+
+def _interpolate(xs, ys, x):
+    return round(_linear(xs, ys, x))
+
+
+def _linear(xs, ys, x):
+    if x <= xs[0]:
+        return ys[0]
+    if x >= xs[-1]:
+        return ys[-1]
+    upper = bisect.bisect_left(xs, x)
+    if xs[upper] == x:
+        return ys[upper]
+    lower = upper - 1
+    return ys[lower] + (x - xs[lower])/(xs[upper] - xs[lower])*(ys[upper] - ys[lower])
@@ -6,11 +6,14 @@ import usb.core
 from PyQt5 import Qt, QtGui, QtCore, QtWidgets, QtChart
 from PyQt5.QtGui import QPalette
 
-import itertools
 import json
+import time
 
 from liquidctl.driver.kraken_two import KrakenTwoDriver
 from liquidctl.driver.nzxt_smart_device import NzxtSmartDeviceDriver
+from liquidctl.driver.hotplug import HotplugMonitor
+from liquidctl.driver.registry import DeviceRegistry
+from liquidctl.daemon import RemoteRegistry, find_daemon
 
 from liquidctl.common.preset import DeviceLightingPreset
 from liquidctl.common.qringwidget import QRingWidget
@@ -23,6 +26,9 @@ DRIVERS = [
     NzxtSmartDeviceDriver,
 ]
 
+# share the devices with the liquidctl daemon, if it is running
+REGISTRY = find_daemon() or DeviceRegistry(DRIVERS)
+
 _channels = ['logo', 'ring', 'sync']
 _attributes = ['channel', 'mode', 'colors', 'speed']
 
@@ -47,19 +53,27 @@ DEFAULT_CONFIG = {
 }
 
 def find_all_supported_devices():
-    res = map(lambda driver: driver.find_supported_devices(), DRIVERS)
-    return itertools.chain(*res)
+    return iter(REGISTRY.devices())
 
 class MainWindow(QtWidgets.QMainWindow):
 
+    # forwards events from the hotplug monitor thread to the GUI thread
+    hotplug_event = QtCore.pyqtSignal(str, object)
+
     def menu_device_reload(self):
-        """Populates device menu with supported devices"""
+        """Rescans and populates device menu with supported devices"""
         last_device = self.device if hasattr(self, 'device') else None
+        if (last_device is not None and last_device.in_session):
+            last_device.disconnect()
 
-        self.devices = list(enumerate(find_all_supported_devices()))
+        self.devices = list(enumerate(REGISTRY.refresh()))
         if len(self.devices) == 0:
             return
 
+        self.menu_device_populate(last_device)
+
+    def menu_device_populate(self, last_device=None):
+        """Populates device menu from self.devices, and selects the device matching last_device"""
         self.ui.menu_Select_Device.clear()
 
         for i, dev in self.devices:
@@ -74,10 +88,39 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.device = dev
 
         self.light_device_selected()
+
+    def device_hotplugged(self, event, dev):
+        """Updates the device menu incrementally when a device is added or removed"""
+        if (event == 'remove'):
+            if (dev is self.device):
+                # remember it to resume once it comes back (e.g. from suspend)
+                dev.stop_background_reader()
+                self.lost_device = dev
+                self.device = None
+            self.devices = list(enumerate(REGISTRY.devices()))
+            for item in self.ui.menu_Select_Device.actions():
+                if (item.objectName() == dev.device.serial_number):
+                    self.ui.menu_Select_Device.removeAction(item)
+            return
+
+        self.devices = list(enumerate(REGISTRY.devices()))
+        lost_device = getattr(self, 'lost_device', None)
+        if (self.device is not None):
+            self.menu_device_populate(self.device)
+        elif (lost_device is None or lost_device.device.serial_number == dev.device.serial_number):
+            self.lost_device = None
+            self.menu_device_populate(dev)
+            if (lost_device is not None):
+                # restore the lighting the device had before it went away
+                self.preset['logo'].write()
+                self.preset['ring'].write()
+
     def menu_device_selected(self):
         """Activates device menu item when clicked"""
         for i, dev in self.devices:
             if (dev.device.serial_number == self.sender().objectName()):
+                if (self.device is not None and self.device is not dev and self.device.in_session):
+                    self.device.disconnect()
                 self.device = dev
                 break
 
@@ -108,7 +151,11 @@ class MainWindow(QtWidgets.QMainWindow):
         """Updates the interface when a device has been selected"""
 
         if ((not self.device is None) and (hasattr(self.device, 'device'))):
-            self.device.connect()
+            # the device is polled continuously, keep it claimed between transfers
+            if (not self.device.in_session):
+                self.device.connect(session=True)
+                # serve the status timer from memory instead of blocking on reads
+                self.device.start_background_reader()
         else:
             raise UnboundLocalError("The selected device is not available")
 
@@ -116,6 +163,10 @@ class MainWindow(QtWidgets.QMainWindow):
             if isinstance(item, QtWidgets.QAction):
                 item.setChecked((self.device.device.serial_number == item.objectName()))
 
+        if (hasattr(self, 'preset')):
+            for preset in self.preset.values():
+                preset.device = self.device
+
         self.ui.comboBoxPresetModes.clear()
 
         for mode in self.device.get_color_modes():
@@ -471,11 +522,14 @@ class MainWindow(QtWidgets.QMainWindow):
         device_rpmlimit_fan = 1400
         device_rpmlimit_pump = 2700
 
-        status = self.device.get_status()
+        # do not stall the UI on missing reports; skip this tick instead
+        status = self.device.get_status_record(deadline=time.monotonic() + 0.25)
+        if status.partial:
+            return
 
-        temp = int(status[0][1])
-        fan = int( ( status[1][1] / device_rpmlimit_fan ) * 100 )
-        pump = int( ( status[2][1] / device_rpmlimit_pump ) * 100 )
+        temp = int(status['Liquid temperature'])
+        fan = int( ( status['Fan speed'] / device_rpmlimit_fan ) * 100 )
+        pump = int( ( status['Pump speed'] / device_rpmlimit_pump ) * 100 )
 
         get_plotwidget_item(self.ui.graphicsViewFanCtl, 'currTemp').setValue(temp)
         get_plotwidget_item(self.ui.graphicsViewFanCtl, 'currFan').setValue(fan)
@@ -581,6 +635,12 @@ class MainWindow(QtWidgets.QMainWindow):
         for channel in _channels:
             self.preset[channel] = DeviceLightingPreset(self.device, channel)
             self.preset[channel].changed.connect(self.preset_changed)
+
+        self.hotplug_event.connect(self.device_hotplugged)
+        # udev events refer to local devices; poll the daemon instead
+        self.hotplug = HotplugMonitor(REGISTRY, use_udev=not isinstance(REGISTRY, RemoteRegistry))
+        self.hotplug.subscribe(self.hotplug_event.emit)
+        self.hotplug.start()
         
         #reads presets from file
         self.import_presets_from_file("config.json")